@@ -0,0 +1,120 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# asyncio front end for CloudFormationExecute and CloudConfig. Each blocking
+# AWS call runs in a worker thread while holding a semaphore shared by every
+# wrapper built with the same limit, and waiting on a stack is an asyncio.sleep
+# between polls, so one event loop can drive hundreds of stacks with only
+# the calls actually in flight occupying a thread.
+
+import asyncio
+
+from itertools import islice
+from time import perf_counter
+
+from .cloud_formation import WAIT_TIMEOUT, WAIT_DELAY, WAIT_MAX_DELAY, EVENT_ATTRIBUTES
+from .cloud_config import CloudConfig
+from .metrics import METRICS
+
+DEFAULT_CONCURRENCY = 16
+
+# events are pulled from the blocking generator a page at a time
+EVENT_BATCH = 100
+
+class AsyncCloudFormationExecute:
+    def __init__(self, executor, limit=None):
+        self.executor = executor
+
+        if limit is None:
+            limit = asyncio.Semaphore(DEFAULT_CONCURRENCY)
+
+        self.limit = limit
+
+    @classmethod
+    def many(cls, executors, concurrency=DEFAULT_CONCURRENCY):
+        limit = asyncio.Semaphore(concurrency)
+
+        return [ cls(executor, limit=limit) for executor in executors ]
+
+    @property
+    def stack_name(self):
+        return self.executor.stack_name
+
+    async def blocking(self, function, *args, **kwargs):
+        async with self.limit:
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def build(self, rollback=True, force=False):
+        return await self.blocking(self.executor.build, rollback=rollback, force=force)
+
+    async def create(self, rollback=True, **kwargs):
+        return await self.blocking(self.executor.create, rollback=rollback, **kwargs)
+
+    async def update(self, rollback=True, **kwargs):
+        return await self.blocking(self.executor.update, rollback=rollback, **kwargs)
+
+    async def plan(self, execute=False, **kwargs):
+        return await self.blocking(self.executor.plan, execute=execute, **kwargs)
+
+    async def find(self, name=None):
+        return await self.blocking(self.executor.find, name=name)
+
+    async def describe(self, name=None):
+        return await self.blocking(self.executor.describe, name)
+
+    async def output(self):
+        return await self.blocking(self.executor.stack_outputs)
+
+    async def status(self):
+        return await self.blocking(self.executor.events, *EVENT_ATTRIBUTES, limit=1)
+
+    # polls hold the semaphore, the sleeps between them don't
+    async def wait(self, quiet=True, timeout=WAIT_TIMEOUT, delay=WAIT_DELAY, max_delay=WAIT_MAX_DELAY):
+        started = perf_counter()
+
+        waiter = self.executor.waiter(quiet=quiet, timeout=timeout, delay=delay, max_delay=max_delay)
+
+        try:
+            while not await self.blocking(waiter.poll) and not waiter.expired():
+                await asyncio.sleep(waiter.next_delay())
+        finally:
+            METRICS.record_phase('wait', perf_counter() - started)
+
+        return self.executor.finish_wait(waiter)
+
+    async def events(self, *attributes, filter=None, limit=None):
+        if not attributes:
+            attributes = EVENT_ATTRIBUTES
+
+        events = self.executor.iter_events(*attributes, filter=filter, limit=limit)
+
+        while True:
+            batch = await self.blocking(lambda: list(islice(events, EVENT_BATCH)))
+
+            for event in batch:
+                yield event
+
+            if len(batch) < EVENT_BATCH:
+                return
+
+    async def deploy(self, rollback=True, force=False, quiet=True, timeout=WAIT_TIMEOUT):
+        await self.build(rollback=rollback, force=force)
+
+        if self.executor.skipped:
+            return None
+
+        return await self.wait(quiet=quiet, timeout=timeout)
+
+# build and wait on every stack at once, at most concurrency AWS calls in
+# flight. Stacks are independent here, DeployScheduler orders dependent ones.
+async def deploy_all(executors, concurrency=DEFAULT_CONCURRENCY, rollback=True, force=False, quiet=True,
+                     timeout=WAIT_TIMEOUT):
+    stacks = AsyncCloudFormationExecute.many(executors, concurrency=concurrency)
+
+    results = await asyncio.gather(*[ stack.deploy(rollback=rollback, force=force, quiet=quiet, timeout=timeout)
+                                      for stack in stacks ],
+                                   return_exceptions=True)
+
+    return { stack.stack_name: result for stack, result in zip(stacks, results) }
+
+async def load_config(context, config, **kwargs):
+    return await asyncio.to_thread(CloudConfig, context, config, **kwargs)
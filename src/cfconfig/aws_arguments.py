@@ -0,0 +1,49 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# the AWS options makeconfig and makedeploy share: the credential cache,
+# the API call rate and the metrics file.
+
+import atexit
+
+from .credentials import CREDENTIAL_CACHE
+from .sessions import SESSIONS
+from .metrics import METRICS, METRICS_FORMATS, METRICS_JSON
+from .rate_limit import RATE_LIMITER, DEFAULT_RATE
+
+def add_aws_arguments(parser):
+    parser.add_argument("--credential-cache", help="reuse assumed role credentials across runs from FILE",
+                        required=False,
+                        default=None)
+
+    parser.add_argument("--api-rate", help="starting AWS API calls per second per account, region and service, "
+                                           "adjusted on throttling, 0 for no limit (default %s)" % DEFAULT_RATE,
+                        type=float,
+                        required=False,
+                        default=DEFAULT_RATE)
+
+    parser.add_argument("--metrics", help="write API call and phase metrics to FILE when the run ends",
+                        required=False,
+                        default=None)
+
+    parser.add_argument("--metrics-format", help="metrics file format (default %s)" % METRICS_JSON,
+                        choices=METRICS_FORMATS,
+                        required=False,
+                        default=METRICS_JSON)
+
+# args is the parsed command line, it also needs the CLI's --jobs
+def configure_aws(args):
+    if args.credential_cache:
+        CREDENTIAL_CACHE.use_file(args.credential_cache)
+
+    if args.metrics:
+        METRICS.enable(SESSIONS)
+
+        # also runs on sys.exit and on errors, a failed run is worth measuring
+        atexit.register(METRICS.write, args.metrics, args.metrics_format)
+
+    SESSIONS.set_concurrency(args.jobs)
+
+    if args.api_rate > 0:
+        RATE_LIMITER.rate = args.api_rate
+    else:
+        SESSIONS.set_limiter(None)
@@ -4,38 +4,263 @@ from os import path
 from datetime import datetime
 from re import sub
 from json import loads
+from collections import OrderedDict, namedtuple
+import sys
+import threading
 
-from .cloud_formation import CloudFormationExecute
+from .cloud_formation import CloudFormationExecute, DEFAULT_REGION, stack_outputs, content_hash
+from .config_formats import FORMAT_TEXT, FORMAT_PYTHON, render, text_value, compile_module
+from .files import replace_file
+from .pool import pool_map
+
+CONFLICT_LAST = 'last'
+CONFLICT_FIRST = 'first'
+CONFLICT_ERROR = 'error'
+
+GENERATED_HEADER = '# Config Generated @ '
+
+# cfconfig's own settings live under this key so they never take a name a
+# static config value might already use
+SETTINGS_KEY = 'cfconfig'
+
+StackSource = namedtuple('StackSource', ['name', 'region', 'context', 'label'])
+ConfigDiff = namedtuple('ConfigDiff', ['added', 'removed', 'changed'])
+
+# progress goes to stderr so a config rendered to stdout can be piped
+def progress(message):
+    print(message, file=sys.stderr)
+
+# the previous body of a generated file without its timestamp header
+def generated_body(file):
+    if not path.isfile(file):
+        return None
+
+    with open(file, "r") as f:
+        contents = f.read()
+
+    if contents.startswith(GENERATED_HEADER):
+        _, _, contents = contents.partition("\n\n")
+
+    return contents
+
+def assignments(body):
+    table = {}
+
+    for line in (body or "").splitlines():
+        key, sep, value = line.partition("=")
+
+        if sep:
+            table[key] = value
+
+    return table
+
+def config_diff(old_body, new_body):
+    old = assignments(old_body)
+    new = assignments(new_body)
+
+    return ConfigDiff(sorted(key for key in new if key not in old),
+                      sorted(key for key in old if key not in new),
+                      sorted(key for key in new if key in old and new[key] != old[key]))
+
+def print_config_diff(label, diff):
+    for key in diff.added:
+        print(f"[%s]: added key -> %s" % (label, key))
+
+    for key in diff.removed:
+        print(f"[%s]: removed key -> %s" % (label, key))
+
+    for key in diff.changed:
+        print(f"[%s]: changed key -> %s" % (label, key))
 
 class CloudConfig:
-    reserved = [ "stacks", "ignore" ]
+    reserved = [ "stacks", "ignore", SETTINGS_KEY ]
 
     context = None
 
     ignore = []
 
+    depends = {}
+
     table = {}
 
     configuration = []
 
+    constants = {}
+
     stacks = []
 
+    jobs = 1
+
+    cache = None
+
+    bulk = False
+
+    region = DEFAULT_REGION
+
+    conflicts = CONFLICT_LAST
+
+    sources = []
+
+    output = None
+
     def insert_into_table(self, key, value, source='static'):
-        print(f"[%s]: adding key -> %s" % (source, key))
+        if key in self.origin and self.table[key] != value:
+            if self.conflicts == CONFLICT_ERROR:
+                raise Exception(f"CFconfig error: %s from %s conflicts with %s" % (key, source, self.origin[key]))
+
+            if self.conflicts == CONFLICT_FIRST:
+                progress(f"[%s]: keeping key from %s -> %s" % (source, self.origin[key], key))
+                return
+
+        progress(f"[%s]: adding key -> %s" % (source, key))
         self.table[key] = value
+        self.origin[key] = source
+
+    def stack_source(self, entry):
+        if isinstance(entry, str):
+            return StackSource(entry, self.region, self.context, entry)
+
+        if "name" not in entry:
+            raise Exception(f"CFconfig error: stack entry without a \"name\" -> %s" % entry)
+
+        region = entry.get("region", self.region)
+        context = self.context._replace(role=entry.get("role", self.context.role),
+                                        profile=entry.get("profile", self.context.profile))
+
+        label = entry["name"]
+
+        if region != self.region or context != self.context:
+            label = f"%s@%s/%s" % (entry["name"], region, context.profile)
+
+        return StackSource(entry["name"], region, context, label)
+
+    def executor(self, source):
+        key = (source.context, source.region)
+
+        with self.lock:
+            if key not in self.executors:
+                # one client pool per account and region shared by its stacks
+                self.executors[key] = CloudFormationExecute(source.context,
+                                                            None,
+                                                            None,
+                                                            region=source.region)
+
+            return self.executors[key]
+
+    # executors, credentials and clients are built on the calling thread,
+    # the pool threads only make API calls through them
+    def prepare(self, sources):
+        for source in sources:
+            self.executor(source).client
+
+    def groups(self, sources):
+        grouped = OrderedDict()
+
+        for source in sources:
+            grouped.setdefault((source.context, source.region), []).append(source)
+
+        return list(grouped.values())
+
+    def map(self, work, items):
+        return pool_map(work, items, self.jobs)
+
+    def read_output(self, source):
+        return self.executor(source).stack_outputs(source.name)
+
+    def fetch_outputs(self, sources):
+        self.prepare(sources)
+
+        return list(zip(sources, self.map(self.read_output, sources)))
+
+    def list_group(self, group):
+        summaries = { summary['StackName']: summary for summary in self.executor(group[0]).index_stacks() }
+
+        return { source: summaries[source.name] for source in group if source.name in summaries }
+
+    def describe_group(self, group):
+        found = self.executor(group[0]).describe_many([ source.name for source in group ])
+
+        return { source: found[source.name] for source in group if source.name in found }
+
+    def across_groups(self, work, sources):
+        self.prepare(sources)
 
-    def read_stacks(self, stacks_list):
+        merged = {}
 
-        for stack_name in stacks_list:
-            stack = CloudFormationExecute(self.context,
-                                          stack_name,
-                                          None)
+        for found in self.map(work, self.groups(sources)):
+            merged.update(found)
 
-            for key,value in stack.output.items():
+        return merged
+
+    def read_cached_outputs(self, sources):
+        summaries = self.across_groups(self.list_group, sources)
+
+        outputs = {}
+        stale = []
+
+        for source in sources:
+            cached = None
+
+            if source in summaries:
+                cached = self.cache.lookup(summaries[source], self.ignore)
+
+            if cached is None:
+                stale.append(source)
+            else:
+                progress(f"[%s]: using cached outputs" % source.label)
+                outputs[source] = cached
+
+        for source, output in self.fetch_outputs(stale):
+            if source in summaries:
+                self.cache.store(summaries[source], output, self.ignore)
+
+            outputs[source] = output
+
+        self.cache.save()
+
+        return [ (source, outputs[source]) for source in sources ]
+
+    def read_bulk_outputs(self, sources):
+        found = self.across_groups(self.describe_group, sources)
+
+        missing = [ source.label for source in sources if source not in found ]
+
+        if missing:
+            raise Exception(f"CFconfig error: stacks not found in %s -> %s" % (self.context.environment,
+                                                                              ", ".join(missing)))
+
+        outputs = []
+
+        for source in sources:
+            output = stack_outputs(found[source])
+
+            if self.cache:
+                self.cache.store(found[source], output, self.ignore)
+
+            outputs.append((source, output))
+
+        if self.cache:
+            self.cache.save()
+
+        return outputs
+
+    def read_outputs(self, sources):
+        if self.bulk:
+            return self.read_bulk_outputs(sources)
+
+        if self.cache:
+            return self.read_cached_outputs(sources)
+
+        return self.fetch_outputs(sources)
+
+    def read_stacks(self, sources):
+
+        for source, output in self.read_outputs(sources):
+            for key,value in output.items():
                 if key not in self.ignore:
-                    self.insert_into_table(key, value, source=stack_name)
+                    self.insert_into_table(key, value, source=source.label)
                 else:
-                    print(f"[%s]: ignoring key -> %s" % (stack_name, key))
+                    progress(f"[%s]: ignoring key -> %s" % (source.label, key))
 
     def read_config(self, config):
         if not path.isfile(config):
@@ -58,34 +283,61 @@ class CloudConfig:
                                                                                     (self.context.environment, 
                                                                                      config))
 
-        self.stacks = stacks_list
+        settings = aws_env.get(SETTINGS_KEY, {})
+
+        if not isinstance(settings, dict):
+            raise Exception(f"CFconfig error: \"%s\" must be an object of cfconfig settings -> %s" % (SETTINGS_KEY,
+                                                                                                    settings))
+
+        if "region" in settings:
+            self.region = settings["region"]
+
+        if "conflicts" in settings:
+            if settings["conflicts"] not in [ CONFLICT_LAST, CONFLICT_FIRST, CONFLICT_ERROR ]:
+                raise Exception(f"CFconfig error: unknown \"conflicts\" rule -> %s" % settings["conflicts"])
+
+            self.conflicts = settings["conflicts"]
+
+        self.sources = [ self.stack_source(entry) for entry in stacks_list ]
+        self.stacks = [ source.name for source in self.sources ]
 
         if "ignore" in aws_env:
             self.ignore = aws_env["ignore"]
+
+        if "depends" in settings:
+            self.depends = settings["depends"]
         
         for key, value in aws_env.items():
             if key not in self.reserved:
                 self.insert_into_table(key, value)
 
-        return stacks_list
+        return self.sources
 
     def generate_configuration(self):
         for config, value in self.table.items():
             cleaned = config.upper().replace('-','_')
 
             constant_name = sub('/^' + self.context.environment + '/','', cleaned)
- 
-            if isinstance(value, str):
-                constant_value = "\"%s\"" % value
-            else:
-                constant_value = str(value)
-            
-            self.configuration.append("%s=%s" % (constant_name, constant_value))
+
+            self.constants[constant_name] = value
+            self.configuration.append("%s=%s" % (constant_name, text_value(value)))
 
         self.configuration.sort()
 
-    def __init__(self, context, config, config_only=False):
+    def __init__(self, context, config, config_only=False, jobs=1, cache=None, bulk=False):
         self.context = context
+        self.jobs = jobs
+        self.cache = cache
+        self.bulk = bulk
+
+        # per instance so a reload never sees a previous load's keys
+        self.table = {}
+        self.configuration = []
+        self.constants = {}
+
+        self.lock = threading.Lock()
+        self.executors = {}
+        self.origin = {}
 
         stacks = self.read_config(config)
 
@@ -104,13 +356,64 @@ class CloudConfig:
         print("\n".join(self.configuration))
         print("\n") 
 
-    def write_configuration(self):
-        f = open(self.output, "w")
- 
-        f.write(f'# Config Generated @ %s\n\n' % datetime.now().isoformat())
+    def configuration_body(self):
+        return "\n".join(self.configuration) + "\n"
+
+    def render_configuration(self, format=FORMAT_TEXT):
+        if format == FORMAT_TEXT:
+            return self.configuration_body().encode('utf-8')
+
+        return render(format, self.constants)
+
+    # the other formats carry no timestamp so their bytes are compared whole
+    def write_format(self, output, format):
+        data = self.render_configuration(format)
+
+        unchanged = False
+
+        if path.isfile(output):
+            with open(output, "rb") as f:
+                unchanged = f.read() == data
+
+        if unchanged:
+            print(f"[%s]: configuration unchanged" % output)
+        else:
+            replace_file(output, data)
+
+        # the bytecode is checked by source hash, recompiling is a no-op when current
+        if format == FORMAT_PYTHON:
+            compile_module(output)
+
+        return not unchanged
+
+    def write_module(self, directory, name):
+        return self.write_format(path.join(directory, name + ".py"), FORMAT_PYTHON)
+
+    # only writes when the generated lines differ from the file's, so the
+    # timestamp header alone never changes the file. Returns True if written.
+    def write_configuration(self, output=None, diff=False, format=FORMAT_TEXT):
+        output = output or self.output
+
+        if not output:
+            raise Exception("CFconfig error: no output file to write the configuration to")
+
+        if diff and format != FORMAT_TEXT:
+            raise Exception("CFconfig error: a diff is only reported for the %s format" % FORMAT_TEXT)
+
+        if format != FORMAT_TEXT:
+            return self.write_format(output, format)
+
+        body = self.configuration_body()
+        previous = generated_body(output)
+
+        if previous is not None and content_hash(previous) == content_hash(body):
+            print(f"[%s]: configuration unchanged" % output)
+            return False
+
+        if diff:
+            print_config_diff(output, config_diff(previous, body))
 
-        f.write("\n".join(self.configuration))
-        f.write("\n")
+        replace_file(output, (GENERATED_HEADER + '%s\n\n' % datetime.now().isoformat()) + body)
 
-        f.close()
+        return True
 
@@ -2,16 +2,28 @@
 from abc import ABC, abstractmethod
 import os.path
 import logging
+import threading
 
-import boto3
-from botocore.config import Config
+# boto3 and botocore are imported where AWS is used so that offline commands
+# such as template rendering start without paying for them.
 
 from collections import OrderedDict, namedtuple
 from functools import cached_property
 
 from pprint import pprint
-from time import sleep
-from json import dumps
+from time import sleep, monotonic, time
+from random import uniform
+from json import dumps, loads
+from hashlib import sha256
+
+from .credentials import CREDENTIAL_CACHE
+from .sessions import SESSIONS
+from .metrics import METRICS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 DEFAULT_REGION = 'us-west-2'
 DEBUG_STREAM = 'boto3.resources'
@@ -36,10 +48,56 @@ BUILT_ROLLBACK_STATUS = ['ROLLBACK_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE']
 
 BUILT_IN_PROGRESS_STATUS = ['CREATE_IN_PROGRESS', 'UPDATE_IN_PROGRESS', 'ROLLBACK_IN_PROGRESS']
 
+LIVE_STACK_STATUS = [
+    'CREATE_IN_PROGRESS', 'CREATE_FAILED', 'CREATE_COMPLETE',
+    'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE',
+    'DELETE_IN_PROGRESS', 'DELETE_FAILED',
+    'UPDATE_IN_PROGRESS', 'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_COMPLETE', 'UPDATE_FAILED',
+    'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_FAILED',
+    'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_ROLLBACK_COMPLETE',
+    'REVIEW_IN_PROGRESS',
+    'IMPORT_IN_PROGRESS', 'IMPORT_COMPLETE',
+    'IMPORT_ROLLBACK_IN_PROGRESS', 'IMPORT_ROLLBACK_FAILED', 'IMPORT_ROLLBACK_COMPLETE'
+]
+
+STACK_TYPE = 'AWS::CloudFormation::Stack'
+
+OPERATION_START_STATUS = ['CREATE_IN_PROGRESS', 'UPDATE_IN_PROGRESS', 'DELETE_IN_PROGRESS',
+                          'IMPORT_IN_PROGRESS', 'REVIEW_IN_PROGRESS']
+
+WAIT_TIMEOUT = 3600
+WAIT_DELAY = 2
+WAIT_MAX_DELAY = 30
+
+FINGERPRINT_TAG = 'CFconfigFingerprint'
+
+CAPABILITIES = ['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM']
+
+CHANGE_SET_PREFIX = 'cfconfig-plan-'
+
+TEMPLATE_BODY_LIMIT = 51200
+TEMPLATE_URL_LIMIT = 1024 * 1024
+
+ARTIFACT_PREFIX = 'cfconfig/templates/'
+
+S3_RESOURCE = 's3'
+
 CF_RESOURCE = 'cloudformation'
 
 AWScontext = namedtuple('AWScontext', ['role', 'profile', 'environment'])
 
+EVENT_ATTRIBUTES = ('logical_resource_id',
+                    'resource_status',
+                    'resource_status_reason',
+                    'stack_id',
+                    'timestamp')
+
+WaitResult = namedtuple('WaitResult', ['status', 'duration', 'failures', 'timed_out'])
+
+TemplateDiff = namedtuple('TemplateDiff', ['added', 'removed', 'modified'])
+
+ChangePlan = namedtuple('ChangePlan', ['diff', 'changes', 'change_set', 'executed'])
+
 def build_tags(given_tags):
     tags = []
 
@@ -53,14 +111,65 @@ def build_tags(given_tags):
 
     return tags
 
+# sorted keys and no whitespace. The fingerprint is hashed from this form so
+# it always comes from the stdlib encoder: orjson writes some floats
+# differently (1e20 against 1e+20) and hosts with and without it would
+# disagree about whether a stack changed.
+def canonical_json(value):
+    return dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def pretty_json(value):
+    if orjson:
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2).decode('utf-8') + "\n"
+
+    return dumps(value, indent=2) + "\n"
+
+def content_hash(canonical):
+    return sha256(canonical.encode('utf-8')).hexdigest()
+
+def template_fingerprint(canonical_template, tags):
+    tagged = sorted((tag['Key'], tag['Value']) for tag in tags if tag['Key'] != FINGERPRINT_TAG)
+
+    return content_hash("[%s,%s]" % (canonical_template, canonical_json(tagged)))
+
+def template_diff(deployed, local):
+    old = (deployed or {}).get("Resources", {})
+    new = local.get("Resources", {})
+
+    return TemplateDiff(
+        added=[ name for name in new if name not in old ],
+        removed=[ name for name in old if name not in new ],
+        modified=[ name for name in new
+                   if name in old and canonical_json(new[name]) != canonical_json(old[name]) ]
+    )
+
+def print_diff(diff):
+    for label, names in [ ("added", diff.added), ("removed", diff.removed), ("modified", diff.modified) ]:
+        for name in names:
+            print("  %-9s %s" % (label, name))
+
+def print_changes(changes):
+    print("  %-8s %-40s %-40s %s" % ("action", "resource", "type", "replacement"))
+
+    for change in changes:
+        resource = change['ResourceChange']
+
+        print("  %-8s %-40s %-40s %s" % (resource['Action'],
+                                         resource['LogicalResourceId'],
+                                         resource['ResourceType'],
+                                         resource.get('Replacement', '-')))
+
 class CloudFormationTemplate(ABC):
     built = None
+
+    serialized = None
     
     env = None
     tags = []
 
     def __init__(self, context, **tags):
         self.env = context.environment
+
         self.tags = build_tags(tags)
 
     def build_output(self, key, value):
@@ -103,7 +212,7 @@ class CloudFormationTemplate(ABC):
             res[1]["Path"] = path
 
         if properties:
-            res[1]["Properties"] = { **properties }
+            res[1]["Properties"] = properties
 
         if policies:
             if "Properties" not in res[1]:
@@ -162,7 +271,7 @@ class CloudFormationTemplate(ABC):
         collect = []
 
         for decl in statements:
-            collect = collect + decl
+            collect.extend(decl)
 
         return {
             "PolicyName" : name,
@@ -176,18 +285,17 @@ class CloudFormationTemplate(ABC):
     def build_template(self, resources, policies, outputs):
         self.built = OrderedDict([
                                   ("AWSTemplateFormatVersion", TEMPLATE_VERSION),
-                                  ("Resources", OrderedDict())
+                                  ("Resources", OrderedDict(resources))
                                 ])
 
-        for res in resources:
-            self.built["Resources"] = OrderedDict(resources)
-
         if policies:
             self.built["Policies"] = policies
 
         if outputs:
             self.built["Outputs"] = OrderedDict(outputs)
 
+        self.invalidate()
+
         return self.built
 
     @abstractmethod
@@ -200,12 +308,36 @@ class CloudFormationTemplate(ABC):
 
         return self.built
 
+    def invalidate(self):
+        self.serialized = {}
+
+    def serialize(self, form):
+        if self.serialized is None:
+            self.serialized = {}
+
+        if form not in self.serialized:
+            if form == 'pretty':
+                self.serialized[form] = pretty_json(self.template)
+            elif form == 'canonical':
+                self.serialized[form] = canonical_json(self.template)
+            elif form == 'fingerprint':
+                self.serialized[form] = content_hash(self.serialize('canonical'))
+            else:
+                raise Exception("CFconfig error: unknown template serialization -> %s" % form)
+
+        return self.serialized[form]
+
     @property
     def json(self):
-        return dumps(
-            self.template,
-            indent=2
-        ) + "\n"
+        return self.serialize('pretty')
+
+    @property
+    def minified(self):
+        return self.serialize('canonical')
+
+    @property
+    def fingerprint(self):
+        return self.serialize('fingerprint')
 
     @property
     def python(self):
@@ -217,7 +349,172 @@ class CloudFormationTemplate(ABC):
         return self.template
 
 
+def stack_outputs(summary):
+    return { out['OutputKey']: out['OutputValue'] for out in summary.get('Outputs', []) }
+
+def stack_missing(error):
+    return (error.response['Error']['Code'] == 'ValidationError' and
+            'does not exist' in error.response['Error']['Message'])
+
+# stack summaries seen during this process keyed by (profile, role, region)
+# and stack name. A name that maps to None is known not to exist. Listings
+# only record which names exist: a ListStacks summary has no Tags or Outputs
+# so a listed stack is still described before it is served.
+class StackIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.stacks = {}
+        self.listed = {}
+
+    def lookup(self, scope, name):
+        with self.lock:
+            known = self.stacks.get(scope, {})
+
+            if name in known:
+                return True, known[name]
+
+            if scope in self.listed and name not in self.listed[scope]:
+                return True, None
+
+        return False, None
+
+    def store(self, scope, name, summary):
+        with self.lock:
+            self.stacks.setdefault(scope, {})[name] = summary
+
+    def store_listing(self, scope, summaries):
+        with self.lock:
+            self.listed[scope] = set(summary['StackName'] for summary in summaries)
+
+    def forget(self, scope, name=None):
+        with self.lock:
+            if name is None:
+                self.stacks.pop(scope, None)
+            else:
+                self.stacks.get(scope, {}).pop(name, None)
+
+            self.listed.pop(scope, None)
+
+    def clear(self):
+        with self.lock:
+            self.stacks.clear()
+            self.listed.clear()
+
+STACK_INDEX = StackIndex()
+
+def event_attribute(name):
+    return ''.join(part.capitalize() for part in name.split('_'))
+
+def stack_event(event):
+    return event['ResourceType'] == STACK_TYPE and event['LogicalResourceId'] == event['StackName']
+
+def terminal_status(status):
+    return not status.endswith('_IN_PROGRESS')
+
+# polls a stack's events newest first, only paging back as far as the last
+# event it has already seen, until the stack reaches a terminal status.
+class StackWaiter:
+    backoff = 1.5
+    jitter = 0.25
+
+    def __init__(self, executor, cursor=None, timeout=WAIT_TIMEOUT, delay=WAIT_DELAY, max_delay=WAIT_MAX_DELAY,
+                 quiet=True):
+        self.executor = executor
+        self.cursor = cursor
+
+        self.timeout = timeout
+        self.initial_delay = delay
+        self.delay = delay
+        self.max_delay = max_delay
+        self.quiet = quiet
+
+        self.started = monotonic()
+
+        self.status = None
+        self.terminal = False
+        self.failures = []
+
+    def fresh_events(self):
+        from botocore.exceptions import ClientError
+
+        fresh = []
+
+        try:
+            for event in self.executor.stack_events():
+                if event['EventId'] == self.cursor:
+                    return fresh
+
+                fresh.append(event)
+
+                # without a cursor only the current operation is of interest
+                if self.cursor is None and stack_event(event) and \
+                   event['ResourceStatus'] in OPERATION_START_STATUS:
+                    return fresh
+        except ClientError as error:
+            if not stack_missing(error):
+                raise
+
+            self.status = 'DELETE_COMPLETE'
+            self.terminal = True
+
+        return fresh
+
+    def poll(self):
+        fresh = self.fresh_events()
+
+        if fresh:
+            self.cursor = fresh[0]['EventId']
+            self.delay = self.initial_delay
+        else:
+            self.delay = min(self.delay * self.backoff, self.max_delay)
+
+        for event in reversed(fresh):
+            status = event['ResourceStatus']
+
+            if not self.quiet:
+                print("%s status: %s %s %s" % (self.executor.stack_name,
+                                               event['LogicalResourceId'],
+                                               status,
+                                               event.get('ResourceStatusReason', '')))
+
+            if stack_event(event):
+                if status in OPERATION_START_STATUS:
+                    self.failures = []
+
+                self.status = status
+                self.terminal = terminal_status(status)
+
+            if status.endswith('_FAILED'):
+                self.failures.append(event)
+
+        return self.terminal
+
+    @property
+    def elapsed(self):
+        return monotonic() - self.started
+
+    def expired(self):
+        return self.timeout is not None and self.elapsed >= self.timeout
+
+    def next_delay(self):
+        delay = self.delay * uniform(1 - self.jitter, 1 + self.jitter)
+
+        if self.timeout is not None:
+            delay = min(delay, max(self.timeout - self.elapsed, 0))
+
+        return delay
+
+    @property
+    def result(self):
+        return WaitResult(status=self.status,
+                          duration=self.elapsed,
+                          failures=self.failures,
+                          timed_out=not self.terminal)
+
 def cf_default_config(region, retries=6, mode='standard'):
+    from botocore.config import Config
+
     return Config(
         region_name = region,
         signature_version = 'v4',
@@ -233,12 +530,20 @@ class CloudFormationExecute:
     context = None
     stack_name = None
 
-    config = None 
-
     tags = []
 
     template = None
 
+    region = None
+
+    event_cursor = None
+
+    skipped = False
+
+    artifact_bucket = None
+    artifact_prefix = ARTIFACT_PREFIX
+    s3_endpoint = None
+
     def __init__(
         self,
         context,
@@ -247,24 +552,26 @@ class CloudFormationExecute:
         region=DEFAULT_REGION,
         config=None, 
         debug=False,
+        artifact_bucket=None,
+        artifact_prefix=ARTIFACT_PREFIX,
+        s3_endpoint=None,
         **kwargs
     ):
         self.context = context
         self.stack_name = stack_name
         self.template = template
+        self.region = region
+
+        self.artifact_bucket = artifact_bucket
+        self.artifact_prefix = artifact_prefix
+        self.s3_endpoint = s3_endpoint
 
         if config:
             self.config = config
-        else:
-            self.config = cf_default_config(region)
-
-        session_default = {
-            'profile_name': context.profile
-        }
-            
-        boto3.setup_default_session(**session_default)
 
         if debug:
+            import boto3
+
             boto3.set_stream_logger(DEBUG_STREAM, logging.DEBUG)
 
         kwargs['region'] = region
@@ -272,9 +579,14 @@ class CloudFormationExecute:
 
         self.tags = build_tags(kwargs)
 
-    @property
-    def role_credentials(self):
-        sts_client = boto3.client('sts')
+    @cached_property
+    def config(self):
+        return cf_default_config(self.region)
+
+    # the STS round trip only, credentials served from the cache are not timed
+    @METRICS.timed('credentials')
+    def assume_role(self):
+        sts_client = SESSIONS.client(self.context.profile, 'sts', self.config)
 
         assume = sts_client.assume_role(
             RoleArn=self.context.role,
@@ -284,21 +596,53 @@ class CloudFormationExecute:
         return assume['Credentials']
 
     @property
-    def role_resource(self):
-            creds = self.role_credentials
+    def role_credentials(self):
+        return CREDENTIAL_CACHE.fetch(self.context.profile,
+                                      self.context.role,
+                                      self.assume_role)
 
-            return boto3.resource(
-                CF_RESOURCE,
-                aws_access_key_id=creds['AccessKeyId'],
-                aws_secret_access_key=creds['SecretAccessKey'],
-                aws_session_token=creds['SessionToken']
-            )
+    @property
+    def credentials(self):
+        if self.context.profile == 'root':
+            return None
+
+        return self.role_credentials
+
+    # the role the credentials above belong to, None for the profile's own
+    @property
+    def credential_role(self):
+        if self.context.profile == 'root':
+            return None
+
+        return self.context.role
+
+    # the account whose API limits the calls count against, named by the role ARN
+    @property
+    def account(self):
+        if self.context.profile == 'root' or not self.context.role:
+            return self.context.profile
+
+        parts = self.context.role.split(':')
+
+        if len(parts) > 4 and parts[4]:
+            return parts[4]
+
+        return self.context.profile
+
+    @property
+    def role_resource(self):
+            return SESSIONS.resource(self.context.profile,
+                                     CF_RESOURCE,
+                                     self.config,
+                                     self.role_credentials,
+                                     account=self.account,
+                                     role=self.context.role)
 
     @property
     def root_resource(self):
-        return boto3.resource(
-            CF_RESOURCE
-        )
+        return SESSIONS.resource(self.context.profile,
+                                 CF_RESOURCE,
+                                 self.config)
 
     @cached_property
     def resource(self):
@@ -311,90 +655,80 @@ class CloudFormationExecute:
         del self.resource
         return None
 
+    @property
+    def client(self):
+        return SESSIONS.client(self.context.profile,
+                               CF_RESOURCE,
+                               self.config,
+                               self.credentials,
+                               account=self.account,
+                               role=self.credential_role)
+
+    @property
+    def scope(self):
+        return (self.context.profile, self.context.role, self.region)
+
     @cached_property
     def existing(self):
         return self.resource.Stack(self.stack_name)
 
+    def stack_outputs(self, name=None):
+        if not name:
+            name = self.stack_name
+
+        summary = self.client.describe_stacks(StackName=name)['Stacks'][0]
+
+        STACK_INDEX.store(self.scope, name, summary)
+
+        return stack_outputs(summary)
+
     @property
     def output(self):
-        data = {}
+        return self.stack_outputs()
 
-        for out in self.existing.outputs:
-            data[out['OutputKey']] = out['OutputValue']
+    def stack_events(self):
+        paginator = self.client.get_paginator('describe_stack_events')
 
-        return data
+        # pages are only requested as the caller consumes events, newest first
+        for page in paginator.paginate(StackName=self.stack_name):
+            yield from page['StackEvents']
 
-    def events(self, *attributes, filter=None, limit=None):
-        if limit:
-            events = self.existing.events.limit(limit)
-        else:
-            events = self.existing.events.all()
+    def iter_events(self, *attributes, filter=None, limit=None):
+        projection = [ (requested, event_attribute(requested)) for requested in attributes ]
 
-        if not events:
-            return []
-
-        summaries = []
+        produced = 0
 
-        for ev in events:
-            if filter and ev.resource_status not in filter:
+        for event in self.stack_events():
+            if filter and event['ResourceStatus'] not in filter:
                 continue
 
-            event_data = OrderedDict()
+            yield OrderedDict((requested, event.get(key)) for requested, key in projection)
 
-            for requested in attributes:
-                event_data[requested] = getattr(ev, requested, None)
+            produced += 1
 
-            summaries.append(event_data)
+            if limit and produced >= limit:
+                return
 
-        if 'timestamp' in attributes:
-            return sorted(summaries, key=lambda x: x['timestamp'], reverse=True)
-
-        return summaries
+    def events(self, *attributes, filter=None, limit=None):
+        return list(self.iter_events(*attributes, filter=filter, limit=limit))
 
     @property
     def status(self):
-        return self.events(
-                'logical_resource_id',
-                'resource_status',
-                'resource_status_reason',
-                'stack_id',
-                'timestamp',
-                count=1
-            )
+        return self.events(*EVENT_ATTRIBUTES, limit=1)
 
     @property
     def failure(self):
-        return self.events(
-                'logical_resource_id',
-                'resource_status',
-                'resource_status_reason',
-                'stack_id',
-                'timestamp',
-                filter=BUILT_FAILED_STATUS,
-            )
+        return self.events(*EVENT_ATTRIBUTES, filter=BUILT_FAILED_STATUS)
 
     @property
     def success(self):
-        return self.events(
-                'logical_resource_id',
-                'resource_status',
-                'resource_status_reason',
-                'stack_id',
-                'timestamp',
-                filter=BUILT_COMPLETE_STATUS
-            )
+        return self.events(*EVENT_ATTRIBUTES, filter=BUILT_COMPLETE_STATUS)
 
     @property
     def finished(self):
-        return self.events(
-                'logical_resource_id',
-                'resource_status',
-                'resource_status_reason',
-                'stack_id',
-                'timestamp',
-                filter=BUILT_COMPLETE_STATUS + BUILT_FAILED_STATUS + BUILT_ROLLBACK_STATUS,
-                count=1
-            )
+        return self.events(*EVENT_ATTRIBUTES,
+                           filter=BUILT_COMPLETE_STATUS + BUILT_FAILED_STATUS + BUILT_ROLLBACK_STATUS,
+                           limit=1)
 
     @property
     def json(self):
@@ -412,100 +746,403 @@ class CloudFormationExecute:
         return self.template
 
     def pending(self):
-        return not self.finished
+        status = self.client.describe_stacks(StackName=self.stack_name)['Stacks'][0]['StackStatus']
+
+        if terminal_status(status):
+            return None
+
+        return status
+
+    def latest_event_id(self):
+        page = self.client.describe_stack_events(StackName=self.stack_name)
+
+        if page['StackEvents']:
+            return page['StackEvents'][0]['EventId']
+
+        return None
+
+    def describe(self, name=None):
+        if not name:
+            name = self.stack_name
+
+        known, summary = STACK_INDEX.lookup(self.scope, name)
+
+        if known:
+            return summary
+
+        from botocore.exceptions import ClientError
+
+        try:
+            summary = self.client.describe_stacks(StackName=name)['Stacks'][0]
+        except ClientError as error:
+            if not stack_missing(error):
+                raise
+
+            summary = None
+
+        STACK_INDEX.store(self.scope, name, summary)
+
+        return summary
+
+    def describe_many(self, names):
+        wanted = set(names)
+        found = {}
+
+        paginator = self.client.get_paginator('describe_stacks')
+
+        complete = True
+
+        for page in paginator.paginate():
+            for summary in page['Stacks']:
+                if summary['StackName'] in wanted:
+                    found[summary['StackName']] = summary
+
+            # stop paging through the account once every stack turned up
+            if len(found) == len(wanted):
+                complete = False
+                break
+
+        for name in wanted:
+            if name in found or complete:
+                STACK_INDEX.store(self.scope, name, found.get(name))
+
+        return found
+
+    def index_stacks(self, status_filter=LIVE_STACK_STATUS, limit=None):
+        paginator = self.client.get_paginator('list_stacks')
 
+        pagination = {}
+
+        if limit:
+            pagination['MaxItems'] = limit
+
+        summaries = []
+
+        for page in paginator.paginate(StackStatusFilter=status_filter,
+                                       PaginationConfig=pagination):
+            summaries.extend(page['StackSummaries'])
+
+        if not limit and set(status_filter) >= set(LIVE_STACK_STATUS):
+            STACK_INDEX.store_listing(self.scope, summaries)
+
+        return summaries
+
+    # limit is accepted for existing callers and ignored, the named stack is
+    # described directly instead of paging through the account's stacks
+    @METRICS.timed('find')
     def find(
             self,  
             name=None, 
-            status_filter=BUILT_COMPLETE_STATUS + BUILT_ROLLBACK_STATUS + BUILT_FAILED_STATUS, 
+            status_filter=BUILT_COMPLETE_STATUS + BUILT_ROLLBACK_STATUS + BUILT_FAILED_STATUS,
             limit=None
         ):
         
         if not name:
             name = self.stack_name
 
-        found = []
+        summary = self.describe(name)
 
-        if limit:
-            stack_list = self.resources = self.resource.stacks.limit(limit)
-        else:
-            stack_list = self.resources = self.resource.stacks.all()
+        if summary and summary['StackStatus'] in status_filter:
+            return [ self.resource.Stack(name) ]
 
-        for stack in stack_list:
-            if stack.stack_name == name and stack.stack_status in status_filter:
-                found.append(stack)
+        return []
 
-        return found
+    @property
+    def fingerprint(self):
+        return template_fingerprint(self.template.minified, self.tags)
+
+    @property
+    def stack_tags(self):
+        return self.tags + [ { 'Key': FINGERPRINT_TAG, 'Value': self.fingerprint } ]
+
+    def unchanged(self):
+        summary = self.describe()
+
+        if not summary or summary['StackStatus'] not in BUILT_COMPLETE_STATUS:
+            return False
 
+        for tag in summary.get('Tags', []):
+            if tag['Key'] == FINGERPRINT_TAG:
+                return tag['Value'] == self.fingerprint
+
+        return False
+
+    @property
+    def s3_client(self):
+        return SESSIONS.client(self.context.profile,
+                               S3_RESOURCE,
+                               self.config,
+                               self.credentials,
+                               endpoint_url=self.s3_endpoint,
+                               account=self.account,
+                               role=self.credential_role)
+
+    def artifact_url(self, key):
+        if self.s3_endpoint:
+            return "%s/%s/%s" % (self.s3_endpoint.rstrip('/'), self.artifact_bucket, key)
+
+        return "https://%s.s3.%s.amazonaws.com/%s" % (self.artifact_bucket, self.region, key)
+
+    def upload_template(self, body):
+        from botocore.exceptions import ClientError
+
+        key = "%s%s.json" % (self.artifact_prefix, self.template.fingerprint)
+
+        try:
+            self.s3_client.head_object(Bucket=self.artifact_bucket, Key=key)
+
+            print("%s: template already stored -> s3://%s/%s" % (self.stack_name, self.artifact_bucket, key))
+        except ClientError as error:
+            if error.response['Error']['Code'] not in [ '404', 'NoSuchKey', 'NotFound' ]:
+                raise
+
+            print("%s: uploading template -> s3://%s/%s" % (self.stack_name, self.artifact_bucket, key))
+
+            self.s3_client.put_object(Bucket=self.artifact_bucket,
+                                      Key=key,
+                                      Body=body.encode('utf-8'),
+                                      ContentType='application/json')
+
+        return self.artifact_url(key)
+
+    def template_arguments(self):
+        body = self.template.minified
+        size = len(body.encode('utf-8'))
+
+        if size <= TEMPLATE_BODY_LIMIT:
+            return {
+                'TemplateBody': body
+            }
+
+        if size > TEMPLATE_URL_LIMIT:
+            raise Exception("CFconfig error: %s template is %d bytes, over the %d byte TemplateURL limit" %
+                            (self.stack_name, size, TEMPLATE_URL_LIMIT))
+
+        if not self.artifact_bucket:
+            raise Exception("CFconfig error: %s template is %d bytes, over the %d byte TemplateBody limit "
+                            "and no artifact bucket is configured" % (self.stack_name, size, TEMPLATE_BODY_LIMIT))
+
+        return {
+            'TemplateURL': self.upload_template(body)
+        }
+
+    @METRICS.timed('create')
     def create(self, rollback=True, **kwargs):
 
         create = {
             'StackName': self.stack_name,
             'DisableRollback': not rollback,
-            'Capabilities': ['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM'],
-            'TemplateBody': self.template.json
+            'Capabilities': CAPABILITIES,
+            **self.template_arguments()
         }
 
-        if self.tags:
-            create['Tags'] = self.tags
+        create['Tags'] = self.stack_tags
 
         if kwargs:
             create.update(kwargs)
 
+        self.event_cursor = None
+
+        STACK_INDEX.forget(self.scope, self.stack_name)
+
         return self.resource.create_stack(**create)
 
+    @METRICS.timed('update')
     def update(self, rollback=True, **kwargs):
         update = {
             'StackName': self.stack_name,
             'DisableRollback': not rollback,
-            'Capabilities': ['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM'],
-            'TemplateBody': self.template.json
+            'Capabilities': CAPABILITIES,
+            **self.template_arguments()
         }
 
-        if self.tags:
-            update['Tags'] = self.tags
+        update['Tags'] = self.stack_tags
 
         if kwargs:
             update.update(kwargs)
 
+        self.event_cursor = self.latest_event_id()
+
+        STACK_INDEX.forget(self.scope, self.stack_name)
+
         return self.existing.update(**update)
 
-    def build(self, rollback=True):
+    def build(self, rollback=True, force=False):
         search = self.find()
 
+        self.skipped = False
+
         if search:
+            if not force and self.unchanged():
+                print("%s: template and tags unchanged, skipping update" % self.stack_name)
+
+                self.skipped = True
+                return None
+
             return self.update(rollback=rollback)
         else:
             return self.create(rollback=rollback)
 
         return None
 
-    def wait(self, quiet=True):
-        while True:
-            pending = self.pending()
+    def deployed_template(self):
+        body = self.client.get_template(StackName=self.stack_name,
+                                        TemplateStage='Original')['TemplateBody']
 
-            if pending is None:
-                break
+        if isinstance(body, str):
+            return loads(body)
+
+        return body
+
+    def change_set_changes(self, change_set):
+        paginator = self.client.get_paginator('describe_change_set')
+
+        changes = []
+
+        for page in paginator.paginate(ChangeSetName=change_set, StackName=self.stack_name):
+            changes.extend(page['Changes'])
+
+        return changes
+
+    def discard_change_set(self, change_set, change_type):
+        self.client.delete_change_set(ChangeSetName=change_set, StackName=self.stack_name)
+
+        # a CREATE change set leaves an empty stack in REVIEW_IN_PROGRESS behind
+        if change_type == 'CREATE':
+            self.client.delete_stack(StackName=self.stack_name)
+
+        STACK_INDEX.forget(self.scope, self.stack_name)
+
+    @METRICS.timed('plan')
+    def plan(self, execute=False, **kwargs):
+        from botocore.exceptions import WaiterError
+
+        exists = self.describe()
+
+        if exists:
+            change_type = 'UPDATE'
+            deployed = self.deployed_template()
+        else:
+            change_type = 'CREATE'
+            deployed = None
+
+        diff = template_diff(deployed, self.template.template)
+
+        print("%s: local template against %s" % (self.stack_name, "deployed" if exists else "new stack"))
+        print_diff(diff)
+
+        if exists and not any(diff) and self.unchanged():
+            print("%s: template and tags unchanged, nothing to plan" % self.stack_name)
+            return ChangePlan(diff, [], None, False)
+
+        change_set = CHANGE_SET_PREFIX + str(int(time()))
+
+        request = {
+            'StackName': self.stack_name,
+            'ChangeSetName': change_set,
+            'ChangeSetType': change_type,
+            'Capabilities': CAPABILITIES,
+            'Tags': self.stack_tags,
+            **self.template_arguments()
+        }
+
+        if kwargs:
+            request.update(kwargs)
+
+        self.client.create_change_set(**request)
+
+        try:
+            self.client.get_waiter('change_set_create_complete').wait(ChangeSetName=change_set,
+                                                                      StackName=self.stack_name)
+        except WaiterError:
+            reason = self.client.describe_change_set(ChangeSetName=change_set,
+                                                     StackName=self.stack_name).get('StatusReason', 'unknown')
+
+            print("%s: change set failed -> %s" % (self.stack_name, reason))
+
+            self.discard_change_set(change_set, change_type)
+
+            return ChangePlan(diff, [], None, False)
+
+        changes = self.change_set_changes(change_set)
+
+        replacing = [ change for change in changes if change['ResourceChange'].get('Replacement') == 'True' ]
+
+        print("%s: change set %s -> %d changes, %d replacements" % (self.stack_name,
+                                                                    change_set,
+                                                                    len(changes),
+                                                                    len(replacing)))
+        print_changes(changes)
+
+        if not execute:
+            self.discard_change_set(change_set, change_type)
+
+            return ChangePlan(diff, changes, change_set, False)
+
+        if exists:
+            self.event_cursor = self.latest_event_id()
+        else:
+            self.event_cursor = None
+
+        self.client.execute_change_set(ChangeSetName=change_set, StackName=self.stack_name)
 
-            if not quiet:
-                print(self.stack_name + " status: " + getattr(pending[0],'resource_status_reason','unknown'))
+        STACK_INDEX.forget(self.scope, self.stack_name)
 
-            sleep(1)
+        return ChangePlan(diff, changes, change_set, True)
 
-def cloud_command(executor, command, limit=None):
+    def waiter(self, quiet=True, timeout=WAIT_TIMEOUT, delay=WAIT_DELAY, max_delay=WAIT_MAX_DELAY):
+        return StackWaiter(self,
+                           cursor=self.event_cursor,
+                           timeout=timeout,
+                           delay=delay,
+                           max_delay=max_delay,
+                           quiet=quiet)
 
+    @METRICS.timed('wait')
+    def wait(self, quiet=True, timeout=WAIT_TIMEOUT, delay=WAIT_DELAY, max_delay=WAIT_MAX_DELAY):
+        waiter = self.waiter(quiet=quiet, timeout=timeout, delay=delay, max_delay=max_delay)
+
+        while not waiter.poll() and not waiter.expired():
+            sleep(waiter.next_delay())
+
+        return self.finish_wait(waiter)
+
+    def finish_wait(self, waiter):
+        # resume from the cursor only if the operation is still running
+        if waiter.terminal:
+            self.event_cursor = None
+        else:
+            self.event_cursor = waiter.cursor
+
+        return waiter.result
+
+TEMPLATE_COMMANDS = [ "template-json", "template-python" ]
+
+def template_command(template, command):
     if command == "template-json":
-        print(executor.template_object.json + "\n")
-        return False
+        print(template.json + "\n")
 
     if command == "template-python":
-        executor.template_object.print()
-        return False
+        template.print()
+
+    return False
+
+def cloud_command(executor, command, limit=None, execute=False):
+
+    if command in TEMPLATE_COMMANDS:
+        return template_command(executor.template_object, command)
 
     if command == "build":
         executor.build()
         return True
 
+    if command == "plan":
+        if executor.plan(execute=execute).executed:
+            executor.wait(quiet=False)
+            return True
+
+        return False
+
     if command == "status":
         pprint(executor.status)
         return False
@@ -519,7 +1156,7 @@ def cloud_command(executor, command, limit=None):
         return False
 
     if command == "events":
-        pprint(executor.events(limit))
+        pprint(executor.events(*EVENT_ATTRIBUTES, limit=limit))
         return False
 
     print("unknown command: %s" % command)
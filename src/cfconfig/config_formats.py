@@ -0,0 +1,195 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# renders the generated constants in formats consumers can load without
+# parsing KEY="value" lines: an importable python module compiled ahead of
+# time, JSON, a .env file and a binary snapshot read through mmap.
+#
+# snapshot layout, little endian:
+#
+#   header  magic "CFCS", version u32, count u32
+#   index   count entries of key offset u32, key length u32,
+#           value offset u32, value length u32, sorted by key
+#   data    utf-8 keys and JSON encoded values
+
+import keyword
+import mmap
+import py_compile
+import struct
+
+from json import dumps, loads
+
+FORMAT_TEXT = 'text'
+FORMAT_PYTHON = 'python'
+FORMAT_JSON = 'json'
+FORMAT_ENV = 'env'
+FORMAT_SNAPSHOT = 'snapshot'
+
+SNAPSHOT_MAGIC = b'CFCS'
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_HEADER = struct.Struct('<4sII')
+SNAPSHOT_ENTRY = struct.Struct('<IIII')
+
+MODULE_HEADER = '# Config Generated by makeconfig, do not edit\n\n'
+
+def text_value(value):
+    if isinstance(value, str):
+        return "\"%s\"" % value
+
+    return str(value)
+
+def render_python(constants):
+    invalid = sorted(name for name in constants if not name.isidentifier() or keyword.iskeyword(name))
+
+    # checked before anything is written, a bad name would only fail on import
+    if invalid:
+        raise Exception("CFconfig error: config keys that are not python identifiers -> %s" % ", ".join(invalid))
+
+    lines = [ "%s = %r" % (name, value) for name, value in sorted(constants.items()) ]
+
+    return MODULE_HEADER + "\n".join(lines) + "\n"
+
+def render_json(constants):
+    return dumps(constants, indent=2, sort_keys=True) + "\n"
+
+def render_env(constants):
+    lines = []
+
+    for name, value in sorted(constants.items()):
+        if not isinstance(value, str):
+            value = dumps(value, ensure_ascii=False)
+
+        # dotenv loaders and docker --env-file do not decode \u escapes
+        lines.append("%s=%s" % (name, dumps(value, ensure_ascii=False)))
+
+    return "\n".join(lines) + "\n"
+
+def render_snapshot(constants):
+    names = sorted(constants)
+
+    keys = [ name.encode('utf-8') for name in names ]
+    values = [ dumps(constants[name]).encode('utf-8') for name in names ]
+
+    offset = SNAPSHOT_HEADER.size + SNAPSHOT_ENTRY.size * len(names)
+
+    index = []
+    data = []
+
+    for key, value in zip(keys, values):
+        index.append(SNAPSHOT_ENTRY.pack(offset, len(key), offset + len(key), len(value)))
+        data.append(key + value)
+
+        offset += len(key) + len(value)
+
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(names)) + b"".join(index) + b"".join(data)
+
+# text is the KEY="value" lines CloudConfig.generate_configuration builds
+RENDERERS = {
+    FORMAT_PYTHON: render_python,
+    FORMAT_JSON: render_json,
+    FORMAT_ENV: render_env,
+    FORMAT_SNAPSHOT: render_snapshot
+}
+
+FORMATS = [ FORMAT_TEXT ] + list(RENDERERS)
+
+def render(format, constants):
+    if format not in RENDERERS:
+        raise Exception("CFconfig error: unknown config format -> %s" % format)
+
+    rendered = RENDERERS[format](constants)
+
+    if isinstance(rendered, str):
+        return rendered.encode('utf-8')
+
+    return rendered
+
+# a hash checked .pyc stays valid however the .py mtime moves, it is only
+# recompiled when the source changes
+def compile_module(file):
+    return py_compile.compile(file,
+                              doraise=True,
+                              invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+
+# read access to a snapshot without loading it, keys are found by binary
+# search over the mapped index and only the looked up value is decoded
+class MappedConfig:
+    def __init__(self, file):
+        self.file = open(file, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.count = SNAPSHOT_HEADER.unpack_from(self.map, 0)
+
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise Exception("CFconfig error: %s is not a config snapshot" % file)
+
+    def entry(self, position):
+        return SNAPSHOT_ENTRY.unpack_from(self.map, SNAPSHOT_HEADER.size + SNAPSHOT_ENTRY.size * position)
+
+    def key(self, position):
+        key_offset, key_length, _, _ = self.entry(position)
+
+        return self.map[key_offset:key_offset + key_length]
+
+    def find(self, name):
+        wanted = name.encode('utf-8')
+
+        low = 0
+        high = self.count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.key(middle) < wanted:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.count and self.key(low) == wanted:
+            return low
+
+        return None
+
+    def value(self, position):
+        _, _, value_offset, value_length = self.entry(position)
+
+        return loads(self.map[value_offset:value_offset + value_length])
+
+    def __getitem__(self, name):
+        position = self.find(name)
+
+        if position is None:
+            raise KeyError(name)
+
+        return self.value(position)
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    def __len__(self):
+        return self.count
+
+    def get(self, name, default=None):
+        position = self.find(name)
+
+        if position is None:
+            return default
+
+        return self.value(position)
+
+    def keys(self):
+        return [ self.key(position).decode('utf-8') for position in range(self.count) ]
+
+    def items(self):
+        return [ (self.key(position).decode('utf-8'), self.value(position)) for position in range(self.count) ]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
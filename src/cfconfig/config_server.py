@@ -0,0 +1,204 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# serves a CloudConfig table over a Unix socket and refreshes it in the
+# background. The protocol is one request line and one response line, UTF-8:
+#
+#   GET <key>            -> OK <json value> | MISSING <key>
+#   MGET <key> <key> ... -> OK <json object of the keys found>
+#   ALL                  -> OK <json object of every key>
+#   KEYS                 -> OK <json list of keys>
+#   STATUS               -> OK <json object describing the server>
+#   PING                 -> OK pong
+#
+# keys are either the config keys or the generated constant names.
+
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+from time import time
+from json import dumps
+
+DEFAULT_REFRESH = 300
+
+class ConfigSnapshot:
+    def __init__(self, config):
+        self.table = dict(config.table)
+        self.constants = dict(config.constants)
+        self.loaded = time()
+
+    def lookup(self, key):
+        if key in self.table:
+            return True, self.table[key]
+
+        if key in self.constants:
+            return True, self.constants[key]
+
+        return False, None
+
+class ConfigRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            request = line.decode('utf-8').strip()
+
+            if not request:
+                continue
+
+            response = self.server.config_server.respond(request)
+
+            self.wfile.write((response + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+class ConfigServer:
+    refresh = DEFAULT_REFRESH
+
+    def __init__(self, load, socket_path, refresh=DEFAULT_REFRESH):
+        self.load = load
+        self.socket_path = socket_path
+        self.refresh = refresh
+
+        self.refreshes = 0
+        self.errors = 0
+        self.last_error = None
+
+        self.snapshot = ConfigSnapshot(load())
+
+        self.stopped = threading.Event()
+        self.server = None
+
+    def respond(self, request):
+        command, _, argument = request.partition(" ")
+        command = command.upper()
+
+        # one snapshot per request, refreshes swap in a new one
+        snapshot = self.snapshot
+
+        if command == "GET":
+            found, value = snapshot.lookup(argument.strip())
+
+            if found:
+                return "OK " + dumps(value)
+
+            return "MISSING " + argument.strip()
+
+        if command == "MGET":
+            values = {}
+
+            for key in argument.split():
+                found, value = snapshot.lookup(key)
+
+                if found:
+                    values[key] = value
+
+            return "OK " + dumps(values)
+
+        if command == "ALL":
+            return "OK " + dumps(snapshot.table)
+
+        if command == "KEYS":
+            return "OK " + dumps(sorted(snapshot.table))
+
+        if command == "STATUS":
+            return "OK " + dumps({
+                'keys': len(snapshot.table),
+                'loaded': snapshot.loaded,
+                'refresh': self.refresh,
+                'refreshes': self.refreshes,
+                'errors': self.errors,
+                'last_error': self.last_error
+            })
+
+        if command == "PING":
+            return "OK pong"
+
+        return "ERR unknown command " + command
+
+    def refresher(self):
+        while not self.stopped.wait(self.refresh):
+            try:
+                self.snapshot = ConfigSnapshot(self.load())
+                self.refreshes += 1
+            except Exception as error:
+                # keep serving the last good table
+                self.errors += 1
+                self.last_error = str(error)
+
+                print("CFconfig WARNING: config refresh failed -> %s" % error)
+
+    def bind(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        # the socket is created owner only, there is no window where other
+        # users can connect before the chmod
+        umask = os.umask(0o177)
+
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, ConfigRequestHandler)
+        finally:
+            os.umask(umask)
+
+        self.server.daemon_threads = True
+        self.server.config_server = self
+
+        os.chmod(self.socket_path, 0o600)
+
+        return self.server
+
+    def terminate(self, signum, frame):
+        self.stop()
+
+        raise SystemExit(128 + signum)
+
+    def serve(self):
+        self.bind()
+
+        if self.refresh:
+            threading.Thread(target=self.refresher, daemon=True).start()
+
+        # SIGTERM removes the socket file just as an interrupt does, signal
+        # handlers can only be installed from the main thread
+        previous = None
+
+        if threading.current_thread() is threading.main_thread():
+            previous = signal.signal(signal.SIGTERM, self.terminate)
+
+        print("serving config on %s, refreshing every %ss" % (self.socket_path, self.refresh))
+
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stop()
+
+            if previous is not None:
+                signal.signal(signal.SIGTERM, previous)
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.server:
+            self.server.server_close()
+            self.server = None
+
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+def query(socket_path, request, timeout=5):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall((request + "\n").encode('utf-8'))
+
+        response = b""
+
+        while not response.endswith(b"\n"):
+            chunk = connection.recv(65536)
+
+            if not chunk:
+                break
+
+            response += chunk
+
+    return response.decode('utf-8').rstrip("\n")
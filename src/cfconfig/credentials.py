@@ -0,0 +1,157 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+import os
+import threading
+
+from datetime import datetime, timedelta, timezone
+from json import loads, dumps
+
+from .files import replace_file
+
+# credentials are refreshed in the background once they are this close to expiring
+REFRESH_MARGIN = timedelta(minutes=10)
+
+# and are never handed out when they are this close to expiring
+EXPIRY_MARGIN = timedelta(minutes=2)
+
+CACHE_ENVIRONMENT = 'CFCONFIG_CREDENTIAL_CACHE'
+
+def expiration_of(credentials):
+    expires = credentials['Expiration']
+
+    if isinstance(expires, str):
+        expires = datetime.fromisoformat(expires)
+
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=timezone.utc)
+
+    return expires
+
+class CredentialCache:
+    refresh_margin = REFRESH_MARGIN
+    expiry_margin = EXPIRY_MARGIN
+
+    cache_file = None
+
+    def __init__(self, cache_file=None, refresh_margin=None, expiry_margin=None):
+        self.lock = threading.Lock()
+
+        self.entries = {}
+        self.fetching = {}
+        self.refreshing = set()
+
+        if refresh_margin:
+            self.refresh_margin = refresh_margin
+
+        if expiry_margin:
+            self.expiry_margin = expiry_margin
+
+        self.use_file(cache_file or os.environ.get(CACHE_ENVIRONMENT))
+
+    def use_file(self, cache_file):
+        with self.lock:
+            self.cache_file = cache_file
+
+            if cache_file:
+                for key, credentials in self.read_file().items():
+                    if key not in self.entries:
+                        self.entries[key] = credentials
+
+    def key(self, profile, role):
+        return "%s|%s" % (profile, role)
+
+    def remaining(self, credentials):
+        return expiration_of(credentials) - datetime.now(timezone.utc)
+
+    def usable(self, credentials):
+        return credentials is not None and self.remaining(credentials) > self.expiry_margin
+
+    def stale(self, credentials):
+        return self.remaining(credentials) <= self.refresh_margin
+
+    def fetch(self, profile, role, assume):
+        key = self.key(profile, role)
+
+        with self.lock:
+            credentials = self.entries.get(key)
+
+            if self.usable(credentials):
+                if self.stale(credentials) and key not in self.refreshing:
+                    self.refreshing.add(key)
+
+                    threading.Thread(target=self.refresh,
+                                     args=(key, assume),
+                                     daemon=True).start()
+
+                return credentials
+
+            # one caller per key goes to STS, everyone else waits for it
+            fetching = self.fetching.setdefault(key, threading.Lock())
+
+        with fetching:
+            with self.lock:
+                credentials = self.entries.get(key)
+
+            if self.usable(credentials):
+                return credentials
+
+            credentials = assume()
+            self.store(key, credentials)
+
+        return credentials
+
+    def refresh(self, key, assume):
+        try:
+            self.store(key, assume())
+        except Exception as error:
+            print("CFconfig WARNING: background credential refresh failed for %s -> %s" % (key, error))
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def store(self, key, credentials):
+        with self.lock:
+            self.entries[key] = credentials
+
+            if self.cache_file:
+                self.write_file()
+
+    def invalidate(self, profile=None, role=None):
+        with self.lock:
+            if profile is None and role is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(self.key(profile, role), None)
+
+            if self.cache_file:
+                self.write_file()
+
+    def read_file(self):
+        if not os.path.isfile(self.cache_file):
+            return {}
+
+        try:
+            with open(self.cache_file, "r") as f:
+                return loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def write_file(self):
+        persisted = {}
+
+        for key, credentials in self.entries.items():
+            if not self.usable(credentials):
+                continue
+
+            persisted[key] = {
+                'AccessKeyId': credentials['AccessKeyId'],
+                'SecretAccessKey': credentials['SecretAccessKey'],
+                'SessionToken': credentials['SessionToken'],
+                'Expiration': expiration_of(credentials).isoformat()
+            }
+
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        replace_file(self.cache_file, dumps(persisted, indent=2), mode=0o600)
+
+CREDENTIAL_CACHE = CredentialCache()
@@ -0,0 +1,37 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+import os
+import stat
+
+from os import path
+
+# write to a temporary file beside path and rename it over path so readers
+# only ever see the old or the new contents. mode is set on the temporary
+# file before anything is written to it, without a mode a file being
+# replaced keeps its permissions.
+def replace_file(file, data, mode=None):
+    directory = path.dirname(path.abspath(file))
+    temporary = path.join(directory, ".%s.%d.tmp" % (path.basename(file), os.getpid()))
+
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    if mode is None and path.exists(file):
+        mode = stat.S_IMODE(os.stat(file).st_mode)
+
+    try:
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666 if mode is None else mode)
+
+        with os.fdopen(fd, "wb") as f:
+            if mode is not None:
+                os.fchmod(f.fileno(), mode)
+
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temporary, file)
+    except BaseException:
+        if path.exists(temporary):
+            os.unlink(temporary)
+
+        raise
@@ -1,7 +1,11 @@
 import argparse
 
 from cfconfig.cloud_config import CloudConfig
-from cfconfig.cloud_formation import AWScontext
+from cfconfig.cloud_formation import AWScontext, STACK_INDEX
+from cfconfig.aws_arguments import add_aws_arguments, configure_aws
+from cfconfig.output_cache import OutputCache, DEFAULT_CACHE_FILE, DEFAULT_TTL
+from cfconfig.config_server import ConfigServer, DEFAULT_REFRESH
+from cfconfig.config_formats import FORMATS, FORMAT_TEXT, FORMAT_SNAPSHOT
 
 def exec():
     parser = argparse.ArgumentParser("Generate configurations from static configuration and AWS CF stacks.")
@@ -14,15 +18,90 @@ def exec():
 
     parser.add_argument("--output", help="output filename or STDOUT if not specified")
 
+    parser.add_argument("--format", help="output format (default %s)" % FORMAT_TEXT,
+                        choices=FORMATS,
+                        required=False,
+                        default=FORMAT_TEXT)
+
+    parser.add_argument("--diff", help="with --output report the keys added, removed or changed (text format)",
+                        action="store_true")
+
+    parser.add_argument("--config-only", help="only generate the static configuration, don't read any stacks",
+                        action="store_true")
+
+    parser.add_argument("--jobs", help="fetch up to N stack outputs concurrently",
+                        type=int,
+                        required=False,
+                        default=1)
+
+    parser.add_argument("--bulk", help="read every stack's outputs from one paginated describe of the account",
+                        action="store_true")
+
+    parser.add_argument("--cache", help="cache stack outputs in FILE (default %s), worth it when the configured "
+                                        "stacks outnumber the account's listing pages" % DEFAULT_CACHE_FILE,
+                        nargs="?",
+                        const=DEFAULT_CACHE_FILE,
+                        required=False,
+                        default=None)
+
+    parser.add_argument("--cache-ttl", help="refetch cached stack outputs older than N seconds",
+                        type=int,
+                        required=False,
+                        default=DEFAULT_TTL)
+
+    parser.add_argument("--no-cache", help="always fetch stack outputs, overrides --cache",
+                        action="store_true")
+
+    add_aws_arguments(parser)
+
+    parser.add_argument("--serve", help="serve the config on Unix socket SOCKET instead of printing it",
+                        required=False,
+                        default=None)
+
+    parser.add_argument("--refresh", help="with --serve reload the config every N seconds, 0 to never reload",
+                        type=int,
+                        required=False,
+                        default=DEFAULT_REFRESH)
+
     args = parser.parse_args()
 
-    config = CloudConfig(AWScontext(role=args.role, profile=args.profile, environment=args.environment),
-                         args.config)
+    if args.diff and args.format != FORMAT_TEXT:
+        parser.error("--diff only applies to --format=%s" % FORMAT_TEXT)
+
+    configure_aws(args)
+
+    cache = None
+
+    if args.cache and not args.no_cache:
+        cache = OutputCache(args.cache, ttl=args.cache_ttl)
+
+    context = AWScontext(role=args.role, profile=args.profile, environment=args.environment)
+
+    def load():
+        # every reload describes the stacks again
+        STACK_INDEX.clear()
+
+        return CloudConfig(context,
+                           args.config,
+                           config_only=args.config_only,
+                           jobs=args.jobs,
+                           cache=cache,
+                           bulk=args.bulk)
+
+    if args.serve:
+        ConfigServer(load, args.serve, refresh=args.refresh).serve()
+        return
+
+    config = load()
 
     if args.output:
-        config.write_configuration(args.output)
-    else:
+        config.write_configuration(args.output, diff=args.diff, format=args.format)
+    elif args.format == FORMAT_TEXT:
         config.print_configuration()
+    elif args.format == FORMAT_SNAPSHOT:
+        raise Exception("CFconfig error: the snapshot format needs --output")
+    else:
+        print(config.render_configuration(args.format).decode('utf-8'))
 
 if __name__ == "__main__":
     exec()
\ No newline at end of file
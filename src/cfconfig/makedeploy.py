@@ -3,43 +3,105 @@ from importlib import import_module
 import sys
 import textwrap
 
-from cfconfig.cloud_formation import cloud_command, AWScontext
-from cfconfig.cloud_config import CloudConfig
+from cfconfig.cloud_formation import cloud_command, template_command, AWScontext, TEMPLATE_COMMANDS
+from cfconfig.cloud_config import CloudConfig, progress
+from cfconfig.aws_arguments import add_aws_arguments, configure_aws
+from cfconfig.scheduler import DeployScheduler, print_results
+from cfconfig.template_cache import TemplateCache, DEFAULT_TEMPLATE_CACHE
+from cfconfig.stack_status import collect_status, print_status, status_json
 
 from functools import cached_property
 
 class cached:
     context = None
 
-    def __init__(self, dir, module, context, config, command):
+    artifact_bucket = None
+    s3_endpoint = None
+
+    template_cache = None
+
+    def __init__(self, dir, module, context, config, command, artifact_bucket=None, s3_endpoint=None,
+                 template_cache=None):
         self.dir = dir
         self.module_name = module
         self.context = context
         self.config = config
         self.command = command
 
+        self.artifact_bucket = artifact_bucket
+        self.s3_endpoint = s3_endpoint
+
+        self.template_cache = template_cache
+
     @cached_property
     def module(self):
-        sys.path.append(self.dir)
+        if self.dir not in sys.path:
+            sys.path.append(self.dir)
+
         globals()[self.module_name] = import_module(self.module_name)
 
         return globals()[self.module_name]
 
+    def render(self):
+        if not self.template_cache:
+            return self.module.template(self.context)
+
+        key = self.template_cache.key(self.dir, self.module_name, self.context)
+
+        rendered = self.template_cache.lookup(key, self.context)
+
+        if rendered:
+            progress("using cached template -> %s" % self.module_name)
+            return rendered
+
+        template = self.module.template(self.context)
+
+        self.template_cache.store(key, template)
+
+        return template
+
     @cached_property
     def template(self):
-        if self.command in ['template-json', 'template-python', 'build']:
-            return self.module.template()
+        if self.command in TEMPLATE_COMMANDS + ['build', 'plan']:
+            return self.render()
         else:
             return None
 
+    @cached_property
+    def cloud_config(self):
+        return CloudConfig(self.context, self.config, config_only=True)
+
     @cached_property
     def stacks(self):
-        return CloudConfig(self.context, self.config, config_only=True).stacks
+        return self.cloud_config.stacks
+
+    @cached_property
+    def sources(self):
+        return self.cloud_config.sources
+
+    @cached_property
+    def depends(self):
+        return self.cloud_config.depends
 
-    def deploy(self, stack):
-        return self.module.deploy(self.context,
-                                  stack,
-                                  self.template)         
+    # source is a StackSource, the hook is given the entry's own role and
+    # profile. It can not be told the region, so an executor built anywhere
+    # but the entry's region is refused rather than deployed to the wrong one.
+    def deploy(self, source):
+        executor = self.module.deploy(source.context,
+                                      source.name,
+                                      self.template)
+
+        if executor.region != source.region:
+            raise Exception("CFconfig error: %s is configured in %s but the deploy hook builds it in %s"
+                            % (source.label, source.region, executor.region))
+
+        if self.artifact_bucket:
+            executor.artifact_bucket = self.artifact_bucket
+
+        if self.s3_endpoint:
+            executor.s3_endpoint = self.s3_endpoint
+
+        return executor
 
 resources = None
 
@@ -51,8 +113,9 @@ def exec():
 
         -> template-json: print the json of the template
         -> template-python: print the python of the template
-        -> build: deploy the template
-        -> status: print the status of the deploy
+        -> build: deploy the template, up to --jobs=N stacks at a time in dependency order
+        -> plan: diff the template against the deployed stack and preview a change set, --execute applies it
+        -> status: print a table of every stack's status, exits 1 if any stack is not healthy
         -> output-json: print the outputs of the stack in JSON
         -> output-python: print the output of the stack in Python
         -> events: print the event history of the stack up to --limit=N entries
@@ -77,10 +140,46 @@ def exec():
                         type=int, 
                         required=False, 
                         default=None)
+
+    parser.add_argument("--jobs", help="deploy up to N independent stacks concurrently",
+                        type=int,
+                        required=False,
+                        default=1)
+
+    parser.add_argument("--json", help="print status as JSON",
+                        action="store_true")
+
+    parser.add_argument("--execute", help="execute the change set created by plan",
+                        action="store_true")
+
+    parser.add_argument("--force", help="update stacks even when the template and tags are unchanged",
+                        action="store_true")
+
+    parser.add_argument("--artifact-bucket", help="S3 bucket for templates too large to submit inline",
+                        required=False,
+                        default=None)
+
+    parser.add_argument("--s3-endpoint", help="S3 endpoint URL for the artifact bucket, e.g. a local S3",
+                        required=False,
+                        default=None)
+
+    parser.add_argument("--template-cache", help="cache rendered templates in DIR (default %s), only the module "
+                                                 "file is hashed, not the helpers it imports" % DEFAULT_TEMPLATE_CACHE,
+                        nargs="?",
+                        const=DEFAULT_TEMPLATE_CACHE,
+                        required=False,
+                        default=None)
+
+    parser.add_argument("--no-template-cache", help="always import the module and render its template, overrides --template-cache",
+                        action="store_true")
+
+    add_aws_arguments(parser)
    
     args = parser.parse_args()
 
-    print(f"makedeploy: [role] -> %s\n[profile] -> %s\n[environment] -> %s\n[module] -> (%s,%s)\n[config] -> %s\n[command] -> %s" 
+    configure_aws(args)
+
+    progress(f"makedeploy: [role] -> %s\n[profile] -> %s\n[environment] -> %s\n[module] -> (%s,%s)\n[config] -> %s\n[command] -> %s" 
           % (args.role, args.profile, args.environment, args.dir, args.module, args.config, args.command))
 
     context = AWScontext(role=args.role, profile=args.profile, environment=args.environment)
@@ -89,16 +188,59 @@ def exec():
                        args.module, 
                        context,
                        args.config,
-                       args.command)
+                       args.command,
+                       artifact_bucket=args.artifact_bucket,
+                       s3_endpoint=args.s3_endpoint,
+                       template_cache=TemplateCache(args.template_cache) if args.template_cache and not args.no_template_cache else None)
     
-    print("executing on stacks: " + ",".join(resources.stacks))
+    progress("executing on stacks: " + ",".join(resources.stacks))
+
+    if args.command == "build":
+        scheduler = DeployScheduler([ (source.name, resources.deploy(source)) for source in resources.sources ],
+                                    depends=resources.depends,
+                                    jobs=args.jobs,
+                                    quiet=False,
+                                    force=args.force)
+
+        results = scheduler.run()
+
+        print_results(results)
+
+        if not all(scheduler.succeeded(result) for result in results.values()):
+            sys.exit(1)
+
+        return
+
+    if args.command == "status":
+        statuses = collect_status([ (source.name, resources.deploy(source)) for source in resources.sources ],
+                                  jobs=args.jobs)
+
+        if args.json:
+            print(status_json(statuses))
+        else:
+            print_status(statuses)
+
+        if not all(status.healthy for status in statuses):
+            sys.exit(1)
+
+        return
+
+    # printing a template needs neither the deploy hook nor, on a cache hit, the module
+    if args.command in TEMPLATE_COMMANDS:
+        for stack in resources.stacks:
+            progress("deploying stack -> " + stack)
+
+            template_command(resources.template, args.command)
+
+        return
 
-    for stack in resources.stacks:
-        print("deploying stack -> " + stack)
+    for source in resources.sources:
+        progress("deploying stack -> " + source.label)
 
-        cloud_command(resources.deploy(stack),        
+        cloud_command(resources.deploy(source),        
                       args.command,
-                      limit=args.limit)
+                      limit=args.limit,
+                      execute=args.execute)
 
 if __name__ == "__main__":
     exec()
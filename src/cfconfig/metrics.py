@@ -0,0 +1,306 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# per operation API call counts, latency, retries and throttles collected from
+# botocore's event hooks, and wall time of the CloudFormationExecute phases.
+# Exported as JSON or a Prometheus textfile.
+
+import threading
+
+from functools import wraps
+from time import perf_counter
+from json import dumps
+
+from .files import replace_file
+
+METRICS_JSON = 'json'
+METRICS_PROMETHEUS = 'prometheus'
+
+METRICS_FORMATS = [ METRICS_JSON, METRICS_PROMETHEUS ]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+THROTTLE_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'TransactionInProgressException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'LimitExceededException',
+    'RequestThrottled',
+    'SlowDown',
+    'PriorRequestNotComplete',
+    'EC2ThrottledException'
+])
+
+STARTED_KEY = 'cfconfig_started'
+
+def error_code(parsed):
+    if not isinstance(parsed, dict):
+        return None
+
+    return parsed.get('Error', {}).get('Code')
+
+def is_throttle(parsed):
+    return error_code(parsed) in THROTTLE_CODES
+
+def event_operation(event_name):
+    # before-call.cloudformation.DescribeStacks -> (cloudformation, DescribeStacks)
+    parts = event_name.split('.')
+
+    return parts[1], parts[2]
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [ 0 ] * len(buckets)
+
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+
+        for index, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[index] += 1
+                break
+
+    # prometheus buckets are cumulative
+    def cumulative(self):
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+
+            yield bound, total
+
+    def report(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'buckets': { str(bound): count for bound, count in self.cumulative() }
+        }
+
+class OperationMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+
+        self.latency = Histogram()
+
+    def report(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'latency': self.latency.report()
+        }
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.operations = {}
+        self.phases = {}
+
+        # state owned elsewhere: name -> (label names, callable returning { labels: { field: value } })
+        self.sources = {}
+
+        self.enabled = False
+
+    def operation(self, service, name):
+        key = (service, name)
+
+        if key not in self.operations:
+            self.operations[key] = OperationMetrics()
+
+        return self.operations[key]
+
+    def before_call(self, event_name=None, context=None, **kwargs):
+        if context is not None:
+            context[STARTED_KEY] = perf_counter()
+
+    def after_call(self, event_name=None, http_response=None, parsed=None, context=None, **kwargs):
+        service, name = event_operation(event_name)
+
+        started = (context or {}).get(STARTED_KEY)
+
+        with self.lock:
+            metrics = self.operation(service, name)
+            metrics.calls += 1
+
+            if started is not None:
+                metrics.latency.observe(perf_counter() - started)
+
+            if isinstance(parsed, dict):
+                metrics.retries += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+
+            if http_response is not None and http_response.status_code >= 300:
+                metrics.errors += 1
+
+    def after_call_error(self, event_name=None, context=None, **kwargs):
+        service, name = event_operation(event_name)
+
+        started = (context or {}).get(STARTED_KEY)
+
+        with self.lock:
+            metrics = self.operation(service, name)
+            metrics.calls += 1
+            metrics.errors += 1
+
+            if started is not None:
+                metrics.latency.observe(perf_counter() - started)
+
+    # called for every attempt, must return None to leave the retry decision alone
+    def needs_retry(self, event_name=None, response=None, **kwargs):
+        if response is None or not is_throttle(response[1]):
+            return None
+
+        service, name = event_operation(event_name)
+
+        with self.lock:
+            self.operation(service, name).throttles += 1
+
+        return None
+
+    def hooks(self):
+        return [
+            ('before-call.*.*', self.before_call),
+            ('after-call.*.*', self.after_call),
+            ('after-call-error.*.*', self.after_call_error),
+            ('needs-retry.*.*', self.needs_retry)
+        ]
+
+    def enable(self, registry):
+        if not self.enabled:
+            registry.add_hooks(self.hooks())
+
+            self.enabled = True
+
+    def add_source(self, name, labels, state):
+        with self.lock:
+            self.sources[name] = (labels, state)
+
+    def record_phase(self, phase, seconds):
+        with self.lock:
+            if phase not in self.phases:
+                self.phases[phase] = Histogram()
+
+            self.phases[phase].observe(seconds)
+
+    def timed(self, phase):
+        def decorator(function):
+            @wraps(function)
+            def timer(*args, **kwargs):
+                started = perf_counter()
+
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record_phase(phase, perf_counter() - started)
+
+            return timer
+
+        return decorator
+
+    def report(self):
+        with self.lock:
+            report = {
+                'operations': {
+                    "%s.%s" % key: metrics.report() for key, metrics in sorted(self.operations.items())
+                },
+                'phases': {
+                    phase: histogram.report() for phase, histogram in sorted(self.phases.items())
+                }
+            }
+
+            sources = sorted(self.sources.items())
+
+        for name, (labels, state) in sources:
+            report[name] = { "/".join(key): fields for key, fields in sorted(state().items()) }
+
+        return report
+
+    def prometheus(self):
+        lines = []
+
+        def header(name, kind, help):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+
+        def histogram(name, labels, values):
+            for bound, count in values.cumulative():
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, values.count))
+            lines.append('%s_sum{%s} %f' % (name, labels, values.sum))
+            lines.append('%s_count{%s} %d' % (name, labels, values.count))
+
+        with self.lock:
+            operations = sorted(self.operations.items())
+            phases = sorted(self.phases.items())
+
+            for counter, help in [ ('calls', 'API calls made'),
+                                   ('errors', 'API calls that failed'),
+                                   ('retries', 'retry attempts made by botocore'),
+                                   ('throttles', 'throttling errors returned') ]:
+                name = 'cfconfig_api_%s_total' % counter
+
+                header(name, 'counter', help)
+
+                for (service, operation), metrics in operations:
+                    lines.append('%s{service="%s",operation="%s"} %d' % (name,
+                                                                         service,
+                                                                         operation,
+                                                                         getattr(metrics, counter)))
+
+            header('cfconfig_api_latency_seconds', 'histogram', 'API call latency including retries')
+
+            for (service, operation), metrics in operations:
+                histogram('cfconfig_api_latency_seconds',
+                          'service="%s",operation="%s"' % (service, operation),
+                          metrics.latency)
+
+            header('cfconfig_phase_seconds', 'histogram', 'wall time of CloudFormationExecute phases')
+
+            for phase, values in phases:
+                histogram('cfconfig_phase_seconds', 'phase="%s"' % phase, values)
+
+            sources = sorted(self.sources.items())
+
+        for name, (labels, state) in sources:
+            current = sorted(state().items())
+
+            fields = sorted(set(field for _, values in current for field in values))
+
+            for field in fields:
+                metric = 'cfconfig_%s_%s' % (name, field)
+
+                header(metric, 'gauge', '%s %s' % (name.replace('_', ' '), field.replace('_', ' ')))
+
+                for key, values in current:
+                    label_text = ",".join('%s="%s"' % pair for pair in zip(labels, key))
+
+                    lines.append('%s{%s} %s' % (metric, label_text, values[field]))
+
+        return "\n".join(lines) + "\n"
+
+    def render(self, format=METRICS_JSON):
+        if format == METRICS_PROMETHEUS:
+            return self.prometheus()
+
+        return dumps(self.report(), indent=2) + "\n"
+
+    # the textfile collector must never read a partial file
+    def write(self, file, format=METRICS_JSON):
+        replace_file(file, self.render(format))
+
+METRICS = Metrics()
@@ -0,0 +1,85 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+import os
+import threading
+
+from time import time
+from json import loads, dumps
+
+from .files import replace_file
+
+DEFAULT_CACHE_FILE = '~/.cfconfig/outputs.json'
+DEFAULT_TTL = 3600
+
+def stack_version(summary):
+    return str(summary.get('LastUpdatedTime') or summary['CreationTime'])
+
+# stack outputs persisted between runs keyed by stack id. An entry is only
+# reused while the stack's LastUpdatedTime is unchanged and it is within the TTL.
+# Ignored keys are never written to disk.
+class OutputCache:
+    path = None
+    ttl = DEFAULT_TTL
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=DEFAULT_TTL):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+
+        self.lock = threading.Lock()
+        self.dirty = False
+
+        self.entries = self.read()
+
+    def read(self):
+        if not os.path.isfile(self.path):
+            return {}
+
+        try:
+            with open(self.path, "r") as f:
+                return loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, summary, ignore):
+        with self.lock:
+            entry = self.entries.get(summary['StackId'])
+
+        if not entry:
+            return None
+
+        if entry['version'] != stack_version(summary):
+            return None
+
+        if entry['ignore'] != sorted(ignore):
+            return None
+
+        if self.ttl is not None and time() - entry['fetched'] > self.ttl:
+            return None
+
+        return entry['outputs']
+
+    def store(self, summary, outputs, ignore):
+        entry = {
+            'name': summary['StackName'],
+            'version': stack_version(summary),
+            'ignore': sorted(ignore),
+            'fetched': time(),
+            'outputs': { key: value for key, value in outputs.items() if key not in ignore }
+        }
+
+        with self.lock:
+            self.entries[summary['StackId']] = entry
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            directory = os.path.dirname(self.path)
+
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+
+            replace_file(self.path, dumps(self.entries, indent=2), mode=0o600)
+
+            self.dirty = False
@@ -0,0 +1,13 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+from concurrent.futures import ThreadPoolExecutor
+
+# work(item) for every item on up to jobs threads, sequential when there is
+# nothing to overlap
+def pool_map(work, items, jobs):
+    if jobs > 1 and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as pool:
+            # map() yields in submission order so results line up with items
+            # exactly as the sequential path would return them.
+            return list(pool.map(work, items))
+
+    return [ work(item) for item in items ]
@@ -0,0 +1,146 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# one token bucket per (account, region, service) shared by every client in
+# the process, so parallel stacks back off together instead of each client
+# retrying on its own. Every attempt, retries included, takes a token before it
+# is sent. The rate grows additively on successful responses and is cut in
+# half on a throttling error, at most once per DECREASE_INTERVAL.
+
+import threading
+
+from time import monotonic, sleep
+
+from .metrics import METRICS, is_throttle
+
+DEFAULT_RATE = 25.0
+MIN_RATE = 0.5
+MAX_RATE = 100.0
+BURST = 10.0
+
+RATE_INCREASE = 0.1
+RATE_DECREASE = 0.5
+DECREASE_INTERVAL = 1.0
+
+class TokenBucket:
+    def __init__(self, rate=DEFAULT_RATE, burst=BURST, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.lock = threading.Lock()
+
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+
+        self.tokens = burst
+        self.updated = monotonic()
+        self.decreased = 0.0
+
+        self.acquired = 0
+        self.throttles = 0
+        self.waited = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        with self.lock:
+            self.refill(monotonic())
+
+            # a negative balance is a reservation, callers queue in order
+            self.tokens -= 1
+            self.acquired += 1
+
+            wait = 0.0
+
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+                self.waited += wait
+
+        if wait:
+            sleep(wait)
+
+        return wait
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def throttled(self):
+        with self.lock:
+            self.throttles += 1
+
+            now = monotonic()
+
+            # one throttling burst is one signal, not one per request in flight
+            if now - self.decreased < DECREASE_INTERVAL:
+                return
+
+            self.decreased = now
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+
+            self.refill(now)
+            self.tokens = min(self.tokens, 0)
+
+    def state(self):
+        with self.lock:
+            return {
+                'rate': round(self.rate, 3),
+                'tokens': round(self.tokens, 3),
+                'acquired': self.acquired,
+                'throttles': self.throttles,
+                'waited_seconds': round(self.waited, 6)
+            }
+
+class RateLimiter:
+    rate = DEFAULT_RATE
+
+    def __init__(self, rate=DEFAULT_RATE):
+        self.lock = threading.Lock()
+        self.rate = rate
+
+        self.buckets = {}
+
+    def bucket(self, account, region, service):
+        key = (account, region, service)
+
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(rate=self.rate)
+
+            return self.buckets[key]
+
+    def attach(self, client, account, service):
+        bucket = self.bucket(account, client.meta.region_name, service)
+
+        # a before-send handler that returns a response would replace the request
+        def before_send(**kwargs):
+            bucket.acquire()
+
+            return None
+
+        # returning None leaves the retry decision to botocore
+        def needs_retry(response=None, **kwargs):
+            if response is None:
+                return None
+
+            if is_throttle(response[1]):
+                bucket.throttled()
+            else:
+                bucket.succeeded()
+
+            return None
+
+        client.meta.events.register('before-send', before_send)
+        client.meta.events.register('needs-retry', needs_retry)
+
+        return client
+
+    def state(self):
+        with self.lock:
+            buckets = list(self.buckets.items())
+
+        return { key: bucket.state() for key, bucket in buckets }
+
+RATE_LIMITER = RateLimiter()
+
+METRICS.add_source('rate_limit', ('account', 'region', 'service'), RATE_LIMITER.state)
@@ -0,0 +1,202 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import monotonic
+
+from .cloud_formation import BUILT_COMPLETE_STATUS, WAIT_TIMEOUT
+
+DEPLOYED = 'deployed'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+DeployResult = namedtuple('DeployResult', ['stack', 'state', 'status', 'duration', 'failures', 'error'])
+
+def template_exports(template):
+    exports = set()
+
+    if not template:
+        return exports
+
+    for output in template.get("Outputs", {}).values():
+        name = output.get("Export", {}).get("Name")
+
+        if isinstance(name, str):
+            exports.add(name)
+
+    return exports
+
+def template_imports(node, found=None):
+    if found is None:
+        found = set()
+
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "Fn::ImportValue" and isinstance(value, str):
+                found.add(value)
+            else:
+                template_imports(value, found)
+    elif isinstance(node, (list, tuple)):
+        for value in node:
+            template_imports(value, found)
+
+    return found
+
+def no_updates(error):
+    return 'No updates are to be performed' in error.response['Error']['Message']
+
+class DeployScheduler:
+    jobs = 1
+
+    def __init__(self, executors, depends=None, jobs=1, quiet=True, timeout=WAIT_TIMEOUT, force=False):
+        self.executors = OrderedDict(executors)
+
+        self.force = force
+        self.jobs = max(jobs, 1)
+        self.quiet = quiet
+        self.timeout = timeout
+
+        self.graph = self.build_graph(depends or {})
+        self.check_cycles()
+
+    def rendered(self, executor):
+        template = executor.template_object
+
+        if template is None:
+            return None
+
+        return template.template
+
+    def build_graph(self, depends):
+        graph = OrderedDict((name, set()) for name in self.executors)
+
+        for name, upstream in depends.items():
+            if name not in graph:
+                continue
+
+            if isinstance(upstream, str):
+                upstream = [ upstream ]
+
+            for dependency in upstream:
+                if dependency not in graph:
+                    raise Exception("CFconfig error: stack %s depends on unknown stack -> %s" % (name, dependency))
+
+                graph[name].add(dependency)
+
+        exporters = {}
+
+        for name, executor in self.executors.items():
+            for export in template_exports(self.rendered(executor)):
+                exporters[export] = name
+
+        for name, executor in self.executors.items():
+            for imported in template_imports(self.rendered(executor)):
+                exporter = exporters.get(imported)
+
+                if exporter and exporter != name:
+                    graph[name].add(exporter)
+
+        return graph
+
+    def check_cycles(self):
+        remaining = { name: set(upstream) for name, upstream in self.graph.items() }
+
+        while remaining:
+            ready = [ name for name, upstream in remaining.items() if not upstream ]
+
+            if not ready:
+                raise Exception("CFconfig error: dependency cycle between stacks -> %s" % ", ".join(remaining))
+
+            for name in ready:
+                del remaining[name]
+
+            for upstream in remaining.values():
+                upstream.difference_update(ready)
+
+    def deploy(self, name):
+        from botocore.exceptions import ClientError
+
+        executor = self.executors[name]
+        started = monotonic()
+
+        print("deploying stack -> " + name)
+
+        try:
+            executor.build(force=self.force)
+        except ClientError as error:
+            if not no_updates(error):
+                raise
+
+            return DeployResult(name, UNCHANGED, None, monotonic() - started, [], None)
+
+        if executor.skipped:
+            return DeployResult(name, UNCHANGED, None, monotonic() - started, [], None)
+
+        result = executor.wait(quiet=self.quiet, timeout=self.timeout)
+
+        if result.status in BUILT_COMPLETE_STATUS:
+            state = DEPLOYED
+        else:
+            state = FAILED
+
+        return DeployResult(name, state, result.status, monotonic() - started, result.failures, None)
+
+    def succeeded(self, result):
+        return result.state in [ DEPLOYED, UNCHANGED ]
+
+    def run(self):
+        results = OrderedDict()
+        waiting = OrderedDict((name, set(upstream)) for name, upstream in self.graph.items())
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while waiting or running:
+                for name, upstream in list(waiting.items()):
+                    failed = [ dependency for dependency in upstream
+                               if dependency in results and not self.succeeded(results[dependency]) ]
+
+                    if failed:
+                        print("blocking stack -> %s: upstream failed %s" % (name, ",".join(sorted(failed))))
+
+                        results[name] = DeployResult(name, BLOCKED, None, 0, [],
+                                                     "upstream failed: " + ",".join(sorted(failed)))
+                        del waiting[name]
+                        continue
+
+                    if len(running) >= self.jobs:
+                        continue
+
+                    if all(dependency in results for dependency in upstream):
+                        running[pool.submit(self.deploy, name)] = name
+                        del waiting[name]
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    name = running.pop(future)
+
+                    try:
+                        results[name] = future.result()
+                    except Exception as error:
+                        results[name] = DeployResult(name, FAILED, None, 0, [], str(error))
+
+                    print("stack %s -> %s" % (name, results[name].state))
+
+        return OrderedDict((name, results[name]) for name in self.graph)
+
+def print_results(results):
+    for result in results.values():
+        line = "%-40s %-10s %-30s %7.1fs" % (result.stack, result.state, result.status or '', result.duration)
+
+        if result.error:
+            line += " " + result.error
+
+        print(line)
+
+        for failure in result.failures:
+            print("    %s %s: %s" % (failure['LogicalResourceId'],
+                                     failure['ResourceStatus'],
+                                     failure.get('ResourceStatusReason', '')))
@@ -0,0 +1,149 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+import threading
+
+from .rate_limit import RATE_LIMITER
+
+# botocore's own default
+DEFAULT_POOL_CONNECTIONS = 10
+
+# one boto3.Session per profile, and clients shared per (profile, role,
+# service, region, endpoint). A client is only rebuilt in place when its
+# role's credentials were refreshed. Sessions are not thread safe so everything
+# is created under the registry lock; clients are safe to share between
+# threads, resources are not and are kept per thread.
+class SessionRegistry:
+    max_pool_connections = DEFAULT_POOL_CONNECTIONS
+
+    limiter = None
+
+    def __init__(self, limiter=None):
+        self.lock = threading.RLock()
+        self.limiter = limiter
+
+        self.sessions = {}
+        self.clients = {}
+        self.resources = {}
+
+        # (event, handler) registered on every session
+        self.hooks = []
+
+    def set_concurrency(self, jobs):
+        connections = max(DEFAULT_POOL_CONNECTIONS, jobs * 2)
+
+        with self.lock:
+            if connections != self.max_pool_connections:
+                self.max_pool_connections = connections
+
+                # pools are sized when a client is built
+                self.clients.clear()
+                self.resources.clear()
+
+    def set_limiter(self, limiter):
+        with self.lock:
+            self.limiter = limiter
+
+            self.clients.clear()
+            self.resources.clear()
+
+    # calls made with the same credentials draw on the same account's budget
+    def limit(self, client, profile, service, account):
+        if self.limiter:
+            self.limiter.attach(client, account or profile, service)
+
+        return client
+
+    def add_hooks(self, hooks):
+        with self.lock:
+            self.hooks.extend(hooks)
+
+            # clients copy their session's handlers when they are built
+            self.sessions.clear()
+            self.clients.clear()
+            self.resources.clear()
+
+    def session(self, profile):
+        with self.lock:
+            if profile not in self.sessions:
+                import boto3
+
+                session = boto3.Session(profile_name=profile)
+
+                for event, handler in self.hooks:
+                    session.events.register(event, handler)
+
+                self.sessions[profile] = session
+
+            return self.sessions[profile]
+
+    def client_config(self, config):
+        from botocore.config import Config
+
+        pooled = Config(max_pool_connections=self.max_pool_connections)
+
+        if config:
+            return config.merge(pooled)
+
+        return pooled
+
+    def key(self, profile, role, service, config, endpoint_url):
+        return (profile, role, service, getattr(config, 'region_name', None), endpoint_url)
+
+    def credential_arguments(self, credentials):
+        if not credentials:
+            return {}
+
+        return {
+            'aws_access_key_id': credentials['AccessKeyId'],
+            'aws_secret_access_key': credentials['SecretAccessKey'],
+            'aws_session_token': credentials['SessionToken']
+        }
+
+    def access_key(self, credentials):
+        if not credentials:
+            return None
+
+        return credentials['AccessKeyId']
+
+    def client(self, profile, service, config=None, credentials=None, endpoint_url=None, account=None, role=None):
+        key = self.key(profile, role, service, config, endpoint_url)
+        access = self.access_key(credentials)
+
+        with self.lock:
+            cached = self.clients.get(key)
+
+            # refreshed credentials replace the client built with the old ones
+            if cached and cached[0] == access:
+                return cached[1]
+
+            client = self.session(profile).client(service,
+                                                  config=self.client_config(config),
+                                                  endpoint_url=endpoint_url,
+                                                  **self.credential_arguments(credentials))
+
+            self.limit(client, profile, service, account)
+
+            self.clients[key] = (access, client)
+
+            return client
+
+    def resource(self, profile, service, config=None, credentials=None, account=None, role=None):
+        key = self.key(profile, role, service, config, None) + (threading.get_ident(),)
+        access = self.access_key(credentials)
+
+        with self.lock:
+            cached = self.resources.get(key)
+
+            if cached and cached[0] == access:
+                return cached[1]
+
+            resource = self.session(profile).resource(service,
+                                                      config=self.client_config(config),
+                                                      **self.credential_arguments(credentials))
+
+            self.limit(resource.meta.client, profile, service, account)
+
+            self.resources[key] = (access, resource)
+
+            return resource
+
+SESSIONS = SessionRegistry(limiter=RATE_LIMITER)
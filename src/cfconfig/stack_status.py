@@ -0,0 +1,93 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# the current status of every configured stack from one paginated
+# describe_stacks pass per account and region. Events are only read for
+# stacks that are not healthy, to find the reason of their latest failure.
+
+from collections import OrderedDict, namedtuple
+from json import dumps
+
+from .cloud_formation import BUILT_COMPLETE_STATUS, BUILT_FAILED_STATUS, OPERATION_START_STATUS, stack_event
+from .pool import pool_map
+
+MISSING_STATUS = 'MISSING'
+
+FAILED_EVENT_STATUS = BUILT_FAILED_STATUS + [ 'DELETE_FAILED', 'ROLLBACK_FAILED', 'UPDATE_ROLLBACK_FAILED',
+                                              'IMPORT_FAILED', 'IMPORT_ROLLBACK_FAILED' ]
+
+StackStatus = namedtuple('StackStatus', ['stack', 'status', 'updated', 'reason', 'healthy'])
+
+def stack_updated(summary):
+    updated = summary.get('LastUpdatedTime') or summary.get('CreationTime')
+
+    if updated is None:
+        return None
+
+    return updated.isoformat(timespec='seconds')
+
+def describe_scope(group):
+    executor = group[0][1]
+
+    return executor.describe_many([ stack for stack, _ in group ])
+
+# the latest failure of the current operation, events older than the
+# operation's start are never paged in
+def failure_reason(entry):
+    stack, executor = entry
+
+    for event in executor.stack_events():
+        if event['ResourceStatus'] in FAILED_EVENT_STATUS:
+            return "%s %s: %s" % (event['LogicalResourceId'],
+                                  event['ResourceStatus'],
+                                  event.get('ResourceStatusReason') or '')
+
+        if stack_event(event) and event['ResourceStatus'] in OPERATION_START_STATUS:
+            return None
+
+    return None
+
+# executors is a list of (stack, CloudFormationExecute)
+def collect_status(executors, jobs=1):
+    scopes = OrderedDict()
+
+    for stack, executor in executors:
+        scopes.setdefault(executor.scope, []).append((stack, executor))
+
+    found = {}
+
+    for described in pool_map(describe_scope, list(scopes.values()), jobs):
+        found.update(described)
+
+    unhealthy = [ (stack, executor) for stack, executor in executors
+                  if stack in found and found[stack]['StackStatus'] not in BUILT_COMPLETE_STATUS ]
+
+    reasons = dict(zip([ stack for stack, _ in unhealthy ], pool_map(failure_reason, unhealthy, jobs)))
+
+    statuses = []
+
+    for stack, executor in executors:
+        if stack not in found:
+            statuses.append(StackStatus(stack, MISSING_STATUS, None, None, False))
+            continue
+
+        summary = found[stack]
+
+        statuses.append(StackStatus(stack,
+                                    summary['StackStatus'],
+                                    stack_updated(summary),
+                                    reasons.get(stack) or summary.get('StackStatusReason'),
+                                    summary['StackStatus'] in BUILT_COMPLETE_STATUS))
+
+    return statuses
+
+def print_status(statuses):
+    print("%-40s %-32s %-26s %s" % ('STACK', 'STATUS', 'LAST UPDATED', 'LAST FAILURE'))
+
+    for status in statuses:
+        print("%-40s %-32s %-26s %s" % (status.stack,
+                                        status.status,
+                                        status.updated or '',
+                                        status.reason or ''))
+
+def status_json(statuses):
+    return dumps([ status._asdict() for status in statuses ], indent=2)
@@ -0,0 +1,83 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+import os
+
+from collections import OrderedDict
+from hashlib import sha256
+from importlib.machinery import PathFinder
+from json import loads, dumps
+
+from .cloud_formation import CloudFormationTemplate
+from .files import replace_file
+
+DEFAULT_TEMPLATE_CACHE = '~/.cfconfig/templates'
+
+# bumped when the cached form changes
+CACHE_VERSION = 1
+
+# a template read back from the cache, construct() has nothing left to do.
+# On a hit this is what the module's deploy hook is given, not the module's
+# own template class, so a hook can only rely on the CloudFormationTemplate
+# interface.
+class RenderedTemplate(CloudFormationTemplate):
+    def __init__(self, context, built):
+        super().__init__(context)
+
+        self.built = built
+
+    def construct(self):
+        pass
+
+# rendered templates keyed by the module's source, the environment and the
+# rest of the context the module's template(context) hook is given. Only the
+# module file itself is hashed, a change to a helper it imports is not seen;
+# --no-template-cache renders anyway.
+class TemplateCache:
+    path = None
+
+    def __init__(self, path=DEFAULT_TEMPLATE_CACHE):
+        self.path = os.path.expanduser(path)
+
+    def source(self, dir, module):
+        spec = PathFinder.find_spec(module, [ dir ])
+
+        if not spec or not spec.origin or not os.path.isfile(spec.origin):
+            return None
+
+        with open(spec.origin, "rb") as f:
+            return f.read()
+
+    def key(self, dir, module, context):
+        source = self.source(dir, module)
+
+        if source is None:
+            return None
+
+        digest = sha256(source)
+
+        digest.update(dumps([ CACHE_VERSION, module, context.environment, context.role, context.profile ]).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def lookup(self, key, context):
+        if not key or not os.path.isfile(self.file(key)):
+            return None
+
+        try:
+            with open(self.file(key), "r") as f:
+                # keeps the key order template-python prints without the cache
+                built = loads(f.read(), object_pairs_hook=OrderedDict)
+        except (OSError, ValueError):
+            return None
+
+        return RenderedTemplate(context, built)
+
+    def store(self, key, template):
+        if not key:
+            return
+
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+
+        replace_file(self.file(key), dumps(template.template))
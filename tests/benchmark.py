@@ -0,0 +1,377 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# offline benchmarks for makeconfig and makedeploy against the local
+# CloudFormation stand-in in standin.py. Each run records wall time, API call
+# counts and peak traced memory as stack count, event history and template
+# size grow, and writes the results as JSON.
+#
+#   python tests/benchmark.py --output bench.json [--quick] [--latency 0.02] [--throttle 0.05]
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import cfconfig.cloud_config
+
+from cfconfig.cloud_formation import CloudFormationTemplate, AWScontext, ROLE_TYPE, STACK_INDEX
+from cfconfig.credentials import CREDENTIAL_CACHE
+
+from standin import StandInCloudFormation, StandInS3, standin_executor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_BUDGET = 0.5
+
+# an offline makedeploy template-json and makeconfig config only run in a
+# fresh interpreter, reporting its own wall time and any AWS modules it loaded
+STARTUP_SCRIPT = """
+import sys
+from time import perf_counter
+
+started = perf_counter()
+
+import cfconfig.makedeploy
+import cfconfig.makeconfig
+import cloud_user
+
+from cfconfig.cloud_config import CloudConfig
+from cfconfig.cloud_formation import AWScontext
+
+context = AWScontext(role="role", profile="profile", environment="dev")
+
+cloud_user.deploy(context, "startup-stack", cloud_user.template(context)).template_object.json
+CloudConfig(context, sys.argv[1], config_only=True)
+
+print("startup-seconds=%f" % (perf_counter() - started))
+print("aws-modules=" + ",".join(sorted(name for name in sys.modules if name.split(".")[0] in ("boto3", "botocore"))))
+"""
+
+CONTEXT = AWScontext(role="arn:aws:iam::000000000000:role/benchCFconfigBuildRole",
+                     profile="bench",
+                     environment="bench")
+
+FULL_SIZES = {
+    'stacks': [ 10, 60, 250 ],
+    'account': [ 100, 1000, 5000 ],
+    'events': [ 100, 1000, 10000 ],
+    'resources': [ 10, 100, 1000, 5000 ],
+    'construction': [ 500, 1000, 2500, 5000 ]
+}
+
+QUICK_SIZES = {
+    'stacks': [ 10, 60 ],
+    'account': [ 100, 1000 ],
+    'events': [ 100, 1000 ],
+    'resources': [ 10, 100, 1000 ],
+    'construction': [ 500, 1000, 2500, 5000 ]
+}
+
+class BenchTemplate(CloudFormationTemplate):
+    def __init__(self, context, resources):
+        super().__init__(context, System="bench", Component="bench")
+
+        self.resources = resources
+
+    def construct(self):
+        resources = []
+        outputs = []
+
+        for index in range(self.resources):
+            name = "Role%d" % index
+
+            resources.append(
+                self.build_resource(
+                    name,
+                    ROLE_TYPE,
+                    self.build_policy(
+                        name + "Policy",
+                        self.build_statement("s3:GetObject", "arn:aws:s3:::bench/%d/*" % index),
+                        self.build_statement("s3:PutObject", "arn:aws:s3:::bench/%d/*" % index, deny_other=True)
+                    ),
+                    RoleName=self.env + name
+                )
+            )
+
+            outputs.append(self.build_output(name + "Arn", self.build_attribute(name, env=self.env)))
+
+        self.build_template(resources, [], outputs)
+
+def reset():
+    STACK_INDEX.clear()
+
+    CREDENTIAL_CACHE.invalidate()
+
+def measure(name, parameters, standin, run):
+    reset()
+    gc.collect()
+
+    if standin:
+        standin.reset_counts()
+
+    tracemalloc.start()
+    started = perf_counter()
+
+    run()
+
+    wall = perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    record = {
+        'benchmark': name,
+        'parameters': parameters,
+        'wall_seconds': round(wall, 6),
+        'peak_kib': round(peak / 1024, 1),
+        'api_calls': dict(standin.calls) if standin else {},
+        'throttled': dict(standin.throttled) if standin else {}
+    }
+
+    print("%-16s %-40s %10.4fs %10.1fKiB %6d calls" % (name,
+                                                    json.dumps(parameters, sort_keys=True),
+                                                    wall,
+                                                    record['peak_kib'],
+                                                    sum(record['api_calls'].values())))
+
+    return record
+
+def bench_config(args, sizes):
+    results = []
+
+    for count in sizes['stacks']:
+        for jobs, bulk in [ (1, False), (8, False), (1, True) ]:
+            standin = StandInCloudFormation(latency=args.latency, throttle=args.throttle)
+
+            names = [ "stack%d" % index for index in range(count) ]
+
+            for name in names:
+                standin.add_stack(name, outputs={ "%sOutput%d" % (name, key): "value" for key in range(10) })
+
+            with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+                f.write(json.dumps({ CONTEXT.environment: { "stacks": names, "Static": "value" } }))
+
+            cfconfig.cloud_config.CloudFormationExecute = standin_executor(standin)
+
+            def run():
+                cfconfig.cloud_config.CloudConfig(CONTEXT, f.name, jobs=jobs, bulk=bulk)
+
+            try:
+                results.append(measure('config', { 'stacks': count, 'jobs': jobs, 'bulk': bulk }, standin, run))
+            finally:
+                os.unlink(f.name)
+
+    return results
+
+def bench_find(args, sizes):
+    results = []
+
+    for count in sizes['account']:
+        standin = StandInCloudFormation(latency=args.latency, throttle=args.throttle)
+
+        for index in range(count):
+            standin.add_stack("stack%d" % index)
+
+        executor = standin_executor(standin)(CONTEXT, "stack%d" % (count - 1), None)
+
+        results.append(measure('find', { 'account_stacks': count }, standin, executor.find))
+
+    return results
+
+def bench_build_wait(args, sizes):
+    results = []
+
+    for count in sizes['events']:
+        standin = StandInCloudFormation(latency=args.latency, throttle=args.throttle)
+        standin.add_stack("bench-stack", events=count)
+
+        template = BenchTemplate(CONTEXT, 10)
+        executor = standin_executor(standin)(CONTEXT, "bench-stack", template)
+
+        def run():
+            executor.build(force=True)
+            executor.wait(delay=0.001, max_delay=0.01)
+
+            executor.status
+            executor.events('logical_resource_id', 'resource_status', limit=50)
+
+        results.append(measure('build_wait', { 'events': count }, standin, run))
+
+    return results
+
+def bench_template(args, sizes):
+    results = []
+
+    for count in sizes['resources']:
+        def run():
+            template = BenchTemplate(CONTEXT, count)
+            template.json
+
+        results.append(measure('template', { 'resources': count }, None, run))
+
+    return results
+
+# templates over the TemplateBody limit go through the artifact bucket, once per content hash
+def bench_oversized(args, sizes):
+    results = []
+
+    for count in sizes['resources']:
+        standin = StandInCloudFormation(latency=args.latency, throttle=args.throttle)
+        s3 = StandInS3(latency=args.latency)
+
+        standin.add_stack("bench-stack")
+
+        template = BenchTemplate(CONTEXT, count)
+        executor = standin_executor(standin, s3)(CONTEXT, "bench-stack", template, artifact_bucket="bench-artifacts")
+
+        def run():
+            for attempt in range(2):
+                executor.template_arguments()
+
+        record = measure('oversized', { 'resources': count, 'bytes': len(template.minified) }, standin, run)
+        record['s3_calls'] = dict(s3.calls)
+
+        results.append(record)
+
+    return results
+
+# construction alone should cost the same per resource at every size
+def bench_construction(args, sizes):
+    results = []
+
+    for count in sizes['construction']:
+        template = BenchTemplate(CONTEXT, count)
+
+        started = perf_counter()
+        template.template
+        wall = perf_counter() - started
+
+        results.append({
+            'benchmark': 'construction',
+            'parameters': { 'resources': count },
+            'wall_seconds': round(wall, 6),
+            'per_resource_us': round(wall / count * 1e6, 3)
+        })
+
+        print("%-16s %-40s %10.4fs %10.3fus/resource" % ('construction',
+                                                        json.dumps({ 'resources': count }),
+                                                        wall,
+                                                        wall / count * 1e6))
+
+    per_resource = [ result['per_resource_us'] for result in results ]
+
+    print("construction scaling: largest/smallest per resource cost = %.2f" % (per_resource[-1] / per_resource[0]))
+
+    return results
+
+def bench_startup(args, sizes):
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([ os.path.join(ROOT, "src"),
+                                                  os.path.join(ROOT, "src", "cfconfig", "CloudFormation") ])
+
+    runs = []
+
+    for attempt in range(5):
+        completed = subprocess.run([ sys.executable, "-c", STARTUP_SCRIPT, os.path.join(ROOT, "tests", "cloud-config.json") ],
+                                   env=environment,
+                                   capture_output=True,
+                                   text=True,
+                                   check=True)
+
+        report = dict(line.split("=", 1) for line in completed.stdout.splitlines() if "=" in line)
+
+        runs.append((float(report['startup-seconds']), report['aws-modules']))
+
+    wall = min(run[0] for run in runs)
+    loaded = runs[0][1]
+
+    print("%-16s %-40s %10.4fs  aws modules: %s" % ('startup', '{}', wall, loaded or 'none'))
+
+    return [{
+        'benchmark': 'startup',
+        'parameters': {},
+        'wall_seconds': round(wall, 6),
+        'budget_seconds': args.startup_budget,
+        'aws_modules': loaded.split(",") if loaded else []
+    }]
+
+def check_startup(results):
+    failures = []
+
+    for result in results:
+        if result['benchmark'] != 'startup':
+            continue
+
+        if result['aws_modules']:
+            failures.append("offline commands imported %s" % ", ".join(result['aws_modules']))
+
+        if result['wall_seconds'] > result['budget_seconds']:
+            failures.append("offline startup took %.3fs, budget is %.3fs" % (result['wall_seconds'],
+                                                                             result['budget_seconds']))
+
+    return failures
+
+BENCHMARKS = {
+    'config': bench_config,
+    'find': bench_find,
+    'build_wait': bench_build_wait,
+    'template': bench_template,
+    'oversized': bench_oversized,
+    'construction': bench_construction,
+    'startup': bench_startup
+}
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark cfconfig against a local CloudFormation stand-in.")
+
+    parser.add_argument("--output", help="write results as JSON to FILE", default="benchmark.json")
+    parser.add_argument("--quick", help="use smaller sizes", action="store_true")
+    parser.add_argument("--latency", help="seconds of latency per API call", type=float, default=0.0)
+    parser.add_argument("--throttle", help="probability an API call is throttled", type=float, default=0.0)
+    parser.add_argument("--startup-budget", help="seconds allowed for offline startup", type=float,
+                        default=STARTUP_BUDGET)
+    parser.add_argument("--only", help="run only the named benchmarks", nargs="*", choices=sorted(BENCHMARKS))
+
+    args = parser.parse_args()
+
+    sizes = QUICK_SIZES if args.quick else FULL_SIZES
+
+    results = []
+
+    for name, bench in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+
+        results.extend(bench(args, sizes))
+
+    report = {
+        'python': platform.python_version(),
+        'latency': args.latency,
+        'throttle': args.throttle,
+        'results': results
+    }
+
+    with open(args.output, "w") as f:
+        f.write(json.dumps(report, indent=2) + "\n")
+
+    print("results written to %s" % args.output)
+
+    failures = check_startup(results)
+
+    for failure in failures:
+        print("REGRESSION: " + failure)
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
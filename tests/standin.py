@@ -0,0 +1,348 @@
+# copyright (2022) Michael Mattie - codermattie@runbox.com
+#
+# a local stand-in for the CloudFormation and STS APIs used by cfconfig, with
+# configurable per call latency and throttling. Throttled calls are retried
+# here the way botocore's standard retry mode would, so callers only see the
+# extra latency.
+
+import itertools
+import random
+import threading
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from time import sleep
+
+from botocore.exceptions import ClientError
+
+from cfconfig.cloud_formation import CloudFormationExecute, STACK_TYPE
+
+PAGE_SIZE = 100
+
+def client_error(code, message, operation):
+    return ClientError({ 'Error': { 'Code': code, 'Message': message } }, operation)
+
+class Meta:
+    pass
+
+class StandInPaginator:
+    def __init__(self, client, operation, key):
+        self.client = client
+        self.operation = operation
+        self.key = key
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        token = None
+
+        while True:
+            if token:
+                kwargs['NextToken'] = token
+
+            page = getattr(self.client, self.operation)(**kwargs)
+
+            yield page
+
+            token = page.get('NextToken')
+
+            if not token:
+                return
+
+class StandInEvents:
+    def register(self, *args, **kwargs):
+        pass
+
+    def unregister(self, *args, **kwargs):
+        pass
+
+class StandInCloudFormation:
+    def __init__(self, latency=0.0, throttle=0.0, settle_polls=2, seed=0):
+        self.latency = latency
+        self.throttle = throttle
+        self.settle_polls = settle_polls
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+
+        self.stacks = {}
+        self.calls = Counter()
+        self.throttled = Counter()
+
+        self.meta = Meta()
+        self.meta.region_name = 'us-west-2'
+        self.meta.events = StandInEvents()
+
+    def reset_counts(self):
+        self.calls.clear()
+        self.throttled.clear()
+
+    # every operation goes through here to pay latency and throttling
+    def call(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+            throttled = self.throttle and self.random.random() < self.throttle
+
+        attempt = 0
+
+        while throttled:
+            attempt += 1
+
+            with self.lock:
+                self.throttled[operation] += 1
+                throttled = self.random.random() < self.throttle
+
+            sleep(self.latency + min(0.05 * 2 ** attempt, 1.0) * self.random.random())
+
+        if self.latency:
+            sleep(self.latency)
+
+    def stack(self, name, operation):
+        if name not in self.stacks:
+            raise client_error('ValidationError', 'Stack with id %s does not exist' % name, operation)
+
+        return self.stacks[name]
+
+    def add_event(self, name, logical, status, resource_type=STACK_TYPE):
+        stack = self.stacks[name]
+
+        stack['events'].insert(0, {
+            'EventId': str(next(self.ids)),
+            'StackId': stack['description']['StackId'],
+            'StackName': name,
+            'LogicalResourceId': logical,
+            'PhysicalResourceId': logical,
+            'ResourceType': resource_type,
+            'ResourceStatus': status,
+            'ResourceStatusReason': '',
+            'Timestamp': datetime.now(timezone.utc)
+        })
+
+        if resource_type == STACK_TYPE and logical == name:
+            stack['description']['StackStatus'] = status
+            stack['description']['LastUpdatedTime'] = datetime.now(timezone.utc)
+
+    def add_stack(self, name, outputs=None, events=0, status='CREATE_COMPLETE', tags=None):
+        self.stacks[name] = {
+            'description': {
+                'StackName': name,
+                'StackId': 'arn:aws:cloudformation:us-west-2:000000000000:stack/%s/%d' % (name, next(self.ids)),
+                'StackStatus': status,
+                'CreationTime': datetime.now(timezone.utc),
+                'Outputs': [ { 'OutputKey': key, 'OutputValue': value } for key, value in (outputs or {}).items() ],
+                'Tags': tags or []
+            },
+            'events': [],
+            'template': '{}',
+            'pending': None
+        }
+
+        self.add_event(name, name, 'CREATE_IN_PROGRESS')
+
+        for index in range(events):
+            self.add_event(name, 'Resource%d' % index, 'UPDATE_COMPLETE', resource_type='AWS::IAM::Role')
+
+        self.add_event(name, name, status)
+
+    def start_operation(self, name, body, tags, operation):
+        stack = self.stacks[name]
+
+        stack['template'] = body
+        stack['description']['Tags'] = tags or []
+        stack['pending'] = [ operation + '_COMPLETE', self.settle_polls ]
+
+        self.add_event(name, name, operation + '_IN_PROGRESS')
+
+    def advance(self, name):
+        stack = self.stacks[name]
+
+        if not stack['pending']:
+            return
+
+        stack['pending'][1] -= 1
+
+        if stack['pending'][1] <= 0:
+            self.add_event(name, name, stack['pending'][0])
+            stack['pending'] = None
+
+    def get_paginator(self, operation):
+        keys = {
+            'describe_stacks': 'Stacks',
+            'list_stacks': 'StackSummaries',
+            'describe_stack_events': 'StackEvents'
+        }
+
+        return StandInPaginator(self, operation, keys[operation])
+
+    def page(self, items, token):
+        start = int(token or 0)
+
+        page = items[start:start + PAGE_SIZE]
+
+        if start + PAGE_SIZE < len(items):
+            return page, str(start + PAGE_SIZE)
+
+        return page, None
+
+    def describe_stacks(self, StackName=None, NextToken=None):
+        self.call('DescribeStacks')
+
+        if StackName:
+            return { 'Stacks': [ dict(self.stack(StackName, 'DescribeStacks')['description']) ] }
+
+        stacks, token = self.page([ dict(stack['description']) for stack in self.stacks.values() ], NextToken)
+
+        response = { 'Stacks': stacks }
+
+        if token:
+            response['NextToken'] = token
+
+        return response
+
+    def list_stacks(self, StackStatusFilter=None, NextToken=None):
+        self.call('ListStacks')
+
+        summaries = []
+
+        for stack in self.stacks.values():
+            description = stack['description']
+
+            if StackStatusFilter and description['StackStatus'] not in StackStatusFilter:
+                continue
+
+            summaries.append({ key: description[key] for key in
+                               [ 'StackName', 'StackId', 'StackStatus', 'CreationTime', 'LastUpdatedTime' ]
+                               if key in description })
+
+        summaries, token = self.page(summaries, NextToken)
+
+        response = { 'StackSummaries': summaries }
+
+        if token:
+            response['NextToken'] = token
+
+        return response
+
+    def describe_stack_events(self, StackName, NextToken=None):
+        self.call('DescribeStackEvents')
+
+        stack = self.stack(StackName, 'DescribeStackEvents')
+
+        if not NextToken:
+            self.advance(StackName)
+
+        events, token = self.page(stack['events'], NextToken)
+
+        response = { 'StackEvents': events }
+
+        if token:
+            response['NextToken'] = token
+
+        return response
+
+    def get_template(self, StackName, TemplateStage=None):
+        self.call('GetTemplate')
+
+        return { 'TemplateBody': self.stack(StackName, 'GetTemplate')['template'] }
+
+    def create_stack(self, StackName, TemplateBody=None, Tags=None, **kwargs):
+        self.call('CreateStack')
+
+        self.add_stack(StackName, status='CREATE_IN_PROGRESS')
+        self.start_operation(StackName, TemplateBody, Tags, 'CREATE')
+
+        return { 'StackId': self.stacks[StackName]['description']['StackId'] }
+
+    def update_stack(self, StackName, TemplateBody=None, Tags=None, **kwargs):
+        self.call('UpdateStack')
+
+        stack = self.stack(StackName, 'UpdateStack')
+
+        if stack['template'] == TemplateBody and stack['description']['Tags'] == (Tags or []):
+            raise client_error('ValidationError', 'No updates are to be performed.', 'UpdateStack')
+
+        self.start_operation(StackName, TemplateBody, Tags, 'UPDATE')
+
+        return { 'StackId': stack['description']['StackId'] }
+
+    def assume_role(self, RoleArn, RoleSessionName):
+        self.call('AssumeRole')
+
+        return {
+            'Credentials': {
+                'AccessKeyId': 'ASIASTANDIN',
+                'SecretAccessKey': 'standin',
+                'SessionToken': 'standin',
+                'Expiration': datetime.now(timezone.utc) + timedelta(hours=1)
+            }
+        }
+
+class StandInStack:
+    def __init__(self, client, name):
+        self.client = client
+        self.stack_name = name
+
+    @property
+    def outputs(self):
+        return self.client.describe_stacks(StackName=self.stack_name)['Stacks'][0]['Outputs']
+
+    def update(self, **kwargs):
+        kwargs['StackName'] = self.stack_name
+
+        return self.client.update_stack(**kwargs)
+
+class StandInResource:
+    def __init__(self, client):
+        self.meta = Meta()
+        self.meta.client = client
+
+    def Stack(self, name):
+        return StandInStack(self.meta.client, name)
+
+    def create_stack(self, **kwargs):
+        self.meta.client.create_stack(**kwargs)
+
+        return self.Stack(kwargs['StackName'])
+
+class StandInS3:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+        self.objects = {}
+        self.calls = Counter()
+
+    def head_object(self, Bucket, Key):
+        self.calls['HeadObject'] += 1
+        sleep(self.latency)
+
+        if (Bucket, Key) not in self.objects:
+            raise client_error('404', 'Not Found', 'HeadObject')
+
+        return { 'ContentLength': len(self.objects[(Bucket, Key)]) }
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls['PutObject'] += 1
+        sleep(self.latency)
+
+        self.objects[(Bucket, Key)] = Body
+
+        return {}
+
+def standin_executor(standin, s3=None):
+    class StandInExecute(CloudFormationExecute):
+        @property
+        def resource(self):
+            return StandInResource(standin)
+
+        @property
+        def client(self):
+            return standin
+
+        @property
+        def s3_client(self):
+            return s3
+
+        def assume_role(self):
+            return standin.assume_role(RoleArn=self.context.role,
+                                       RoleSessionName="CFBuildSession")['Credentials']
+
+    return StandInExecute